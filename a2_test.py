@@ -0,0 +1,529 @@
+"""CSC148 Assignment 2
+
+=== CSC148 Winter 2020 ===
+Department of Computer Science,
+University of Toronto
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+Authors: Diane Horton, David Liu, Mario Badr, Sophia Huynh, Misha Schwartz,
+and Jaisie Sin
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) Diane Horton, David Liu, Mario Badr, Sophia Huynh,
+Misha Schwartz, and Jaisie Sin
+
+=== Module Description ===
+
+This file contains tests for the Blocky game, to be run with pytest.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+import random
+import threading
+import time
+
+import pytest
+
+from block import Block, generate_board, decode_block, undo_move
+from goal import BlobGoal, PerimeterGoal, ScoreCache, SCORE_CACHE, \
+    score_all, _blob_sizes, _flatten_grid, _largest_blobs
+from parallel import score_move
+from player import Player, MCTSPlayer, SearchPlayer, SmartPlayer, \
+    _random_move
+from settings import COLOUR_LIST
+
+# Moves to try, as (action, direction) pairs
+_MOVES = [('rotate', 1), ('rotate', 3), ('swap', 0), ('swap', 1),
+          ('smash', None), ('paint', None), ('combine', None)]
+
+
+def _random_block(board: Block, rng: random.Random) -> Block:
+    """Return a Block within <board>, read from <board> the way a player
+    selects one.
+    """
+    block = board
+    while len(block.children) != 0 and rng.random() < 0.7:
+        block = rng.choice(block.children)
+    return block
+
+
+def _assert_fresh(board: Block) -> None:
+    """Assert that the cached hash and positions of <board> match those of a
+    newly built copy of it.
+    """
+    fresh = decode_block(board.encode())
+    assert hash(board) == hash(fresh)
+    assert str(board) == str(fresh)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_persistent_move_versions_independent(seed: int) -> None:
+    """Changing any version of a board in place, as GameData and the players
+    do, leaves every other version unchanged.
+    """
+    rng = random.Random(seed)
+    random.seed(seed)
+    versions = [generate_board(rng.randint(1, 5), 750)]
+    for _ in range(30):
+        board = rng.choice(versions)
+        action, direction = rng.choice(_MOVES)
+        colour = rng.choice(COLOUR_LIST)
+        before = [version.encode() for version in versions]
+        if rng.random() < 0.5:
+            new = board.persistent_move(_random_block(board, rng), action,
+                                        direction, colour)
+            if new is not None:
+                versions.append(new)
+                before.append(new.encode())
+        elif _random_block(board, rng).apply_move(action, direction,
+                                                  colour) is not None:
+            before[_index_of(versions, board)] = board.encode()
+        for version, encoded in zip(versions, before):
+            assert version.encode() == encoded
+            _assert_fresh(version)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_persistent_move_held_blocks(seed: int) -> None:
+    """A Block read before a persistent move either still changes its own
+    board when painted, or is frozen and changes neither version.
+    """
+    rng = random.Random(seed)
+    random.seed(seed)
+    board = generate_board(4, 750)
+    held = [block for block in _blocks(board) if block.level == 4]
+    new = board.persistent_move(_random_block(board, rng),
+                                *rng.choice(_MOVES), rng.choice(COLOUR_LIST))
+    encoded = None if new is None else new.encode()
+    for block in held:
+        colour = rng.choice([c for c in COLOUR_LIST if c != block.colour])
+        before = board.encode()
+        if block.paint(colour):
+            assert board.encode() != before
+        else:
+            assert board.encode() == before
+        if new is not None:
+            assert new.encode() == encoded
+    _assert_fresh(board)
+
+
+def _blocks(board: Block) -> List[Block]:
+    """Return <board> and every Block within it, read the way a player
+    reads them.
+    """
+    blocks = [board]
+    for block in blocks:
+        blocks.extend(block.children)
+    return blocks
+
+
+def test_persistent_move_rotate_shares_children() -> None:
+    """Rotating the whole board makes a new root that shares its children
+    with the old one, and changing the new root leaves the old one unchanged.
+    """
+    random.seed(0)
+    board = generate_board(4, 750)
+    encoded = board.encode()
+    new = board.persistent_move(board, 'rotate', 1)
+    assert all(new_child is child for new_child, child in
+               zip(new._children, board._children))
+
+    new.children[0].apply_move('rotate', 3)
+    new.apply_move('swap', 1)
+    assert board.encode() == encoded
+    _assert_fresh(board)
+    _assert_fresh(new)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_create_copy_pending_rotations(seed: int) -> None:
+    """Copying a board with rotations that have not been applied to the
+    children of some Blocks yet copies the board as it is seen.
+    """
+    random.seed(seed)
+    board = generate_board(4, 750)
+    rng = random.Random(seed)
+    for _ in range(20):
+        block = _random_block(board, rng)
+        block.apply_move('rotate', rng.choice([1, 3]))
+    board.apply_move('rotate', 1)
+    copy = board.create_copy()
+    encoded = board.encode()
+    assert copy.encode() == encoded
+    _assert_fresh(copy)
+
+
+def test_positions_kept_while_copy_changes() -> None:
+    """Moves on a copy of a board, as a player makes while it thinks, leave
+    the derived positions of the board itself up to date.
+    """
+    random.seed(2)
+    board = generate_board(4, 750)
+    text = str(board)
+    epoch = board._tree_epoch
+    copy = board.create_copy()
+    rng = random.Random(2)
+    for _ in range(20):
+        _random_block(copy, rng).apply_move(*rng.choice(_MOVES),
+                                            rng.choice(COLOUR_LIST))
+    assert board._tree_epoch == epoch
+    assert all(block._epoch == epoch for block in _blocks(board)[1:])
+    assert str(board) == text
+
+
+def test_mcts_reuses_opponent_moves() -> None:
+    """The tree an MCTSPlayer keeps has its opponents' moves, in their
+    colours, so that it is reused after the opponents make moves in it.
+    """
+    random.seed(1)
+    board = generate_board(3, 750)
+    goals = [BlobGoal(COLOUR_LIST[0]), PerimeterGoal(COLOUR_LIST[1])]
+    player = MCTSPlayer(0, goals[0], node_budget=300, seed=1,
+                        opponents=goals[1:])
+    player.proceed()
+    move = player.generate_move(board)
+    move[2].apply_move(move[0], move[1], goals[0].colour)
+
+    node = player._root
+    assert node.turn == 1
+    # A smash can not be repeated exactly, so follow another move
+    node = max([child for child in node.children if child.move[0] != 'smash'],
+               key=lambda child: child.visits)
+    block = board.follow_path(node.move[2])
+    block.apply_move(node.move[0], node.move[1], goals[1].colour)
+    assert hash(board) == node.key
+    assert node.turn == 0
+    assert player._reuse_root(board) is node
+
+
+def _old_flatten(block: Block) -> List[List[Tuple[int, int, int]]]:
+    """Return the colours of the unit cells of <block>, column by column,
+    the way the goals first flattened a board.
+    """
+    if block.colour is not None:
+        length = 2 ** (block.max_depth - block.level)
+        return [[block.colour] * length for _ in range(length)]
+    children = [_old_flatten(child) for child in block.children]
+    return [top + bottom for top, bottom in zip(children[1], children[2])] + \
+        [top + bottom for top, bottom in zip(children[0], children[3])]
+
+
+def _old_perimeter(cells: List[List[Tuple[int, int, int]]],
+                   colour: Tuple[int, int, int]) -> int:
+    """Return the number of unit cells of <colour> on the edges of <cells>,
+    counting the corners twice.
+    """
+    edges = cells[0] + cells[-1] + [column[0] for column in cells] + \
+        [column[-1] for column in cells]
+    return edges.count(colour)
+
+
+def _old_blob_sizes(cells: List[List[Tuple[int, int, int]]],
+                    colour: Tuple[int, int, int]) -> List[int]:
+    """Return the sizes of the blobs of <colour> in <cells>, found by
+    searching from each unvisited cell in turn.
+    """
+    length = len(cells)
+    visited = [[False] * length for _ in range(length)]
+    sizes = []
+    for i in range(length):
+        for j in range(length):
+            if visited[i][j] or cells[i][j] != colour:
+                continue
+            visited[i][j] = True
+            queue = [(i, j)]
+            for x, y in queue:
+                for nx, ny in [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]:
+                    if 0 <= nx < length and 0 <= ny < length and \
+                            not visited[nx][ny] and cells[nx][ny] == colour:
+                        visited[nx][ny] = True
+                        queue.append((nx, ny))
+            sizes.append(len(queue))
+    return sizes
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_blob_goal_incremental_matches_rescan(seed: int) -> None:
+    """After each of a series of local moves, and the undoing of some, the
+    incremental BlobGoal, the whole board BlobGoal and PerimeterGoal agree
+    with a search of the flattened board.
+    """
+    rng = random.Random(seed)
+    random.seed(seed)
+    board = generate_board(rng.randint(1, 5), 750)
+    incremental = [BlobGoal(colour) for colour in COLOUR_LIST]
+    undos = []
+    for _ in range(40):
+        if undos and rng.random() < 0.3:
+            undo_move(undos.pop())
+        else:
+            undo = _random_block(board, rng).apply_move(
+                *rng.choice(_MOVES), rng.choice(COLOUR_LIST), rng)
+            if undo is not None:
+                undos.append(undo)
+        cells = _old_flatten(board)
+        for goal in incremental:
+            expected = max(_old_blob_sizes(cells, goal.colour), default=0)
+            assert goal._score(board) == expected
+            assert BlobGoal(goal.colour, False)._score(board) == expected
+            assert PerimeterGoal(goal.colour)._score(board) == \
+                _old_perimeter(cells, goal.colour)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_blob_helpers_match_search(seed: int) -> None:
+    """_blob_sizes and _largest_blobs find the same blobs as a search of the
+    flattened board.
+    """
+    random.seed(seed)
+    board = generate_board(random.randint(1, 5), 750)
+    cells = _old_flatten(board)
+    grid = _flatten_grid(board)
+    largest = _largest_blobs(grid)
+    for index, colour in enumerate(COLOUR_LIST):
+        sizes = _old_blob_sizes(cells, colour)
+        assert sorted(_blob_sizes(grid, index)) == sorted(sizes)
+        assert largest.get(index, 0) == max(sizes, default=0)
+
+
+def test_score_cache_evicts_least_recently_used() -> None:
+    """A full ScoreCache evicts the score used least recently, and counts
+    each lookup once, as a hit or a miss.
+    """
+    cache = ScoreCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+    cache.clear()
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+@pytest.mark.parametrize('goal', [BlobGoal(COLOUR_LIST[0]),
+                                  PerimeterGoal(COLOUR_LIST[0])])
+def test_score_steps_looks_up_once(goal: BlobGoal) -> None:
+    """Scoring a board with score_steps counts one miss in SCORE_CACHE, and
+    scoring it again counts one hit.
+    """
+    random.seed(0)
+    board = generate_board(4, 750)
+    SCORE_CACHE.clear()
+    score = list(goal.score_steps(board))[-1]
+    assert (SCORE_CACHE.hits, SCORE_CACHE.misses) == (0, 1)
+    assert list(goal.score_steps(board)) == [score]
+    assert (SCORE_CACHE.hits, SCORE_CACHE.misses) == (1, 1)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_score_all_matches_search(seed: int) -> None:
+    """score_all gives every goal the score found by a search of the
+    flattened board, whether or not the scores are cached.
+    """
+    random.seed(seed)
+    board = generate_board(random.randint(1, 5), 750)
+    cells = _old_flatten(board)
+    goals = [goal(colour) for colour in COLOUR_LIST
+             for goal in [BlobGoal, PerimeterGoal]]
+    expected = [max(_old_blob_sizes(cells, goal.colour), default=0)
+                if isinstance(goal, BlobGoal) else
+                _old_perimeter(cells, goal.colour) for goal in goals]
+    SCORE_CACHE.clear()
+    assert score_all(board, goals) == expected
+    assert score_all(board, goals) == expected
+    assert [goal.score(board) for goal in goals] == expected
+
+
+def _old_random_move(board: Block, colour: Tuple[int, int, int],
+                     rng: random.Random) -> \
+        Tuple[str, Optional[int], Block]:
+    """Return a random move on <board>, chosen the way RandomPlayer first
+    did: a random level, a Block at it found by descending to random children,
+    and a random action, all chosen again until the move can be performed.
+    """
+    while True:
+        level = rng.randint(0, board.max_depth)
+        block = board
+        while level > block.level and block.colour is None:
+            block = block.children[rng.randint(0, 3)]
+        action = rng.choice(_MOVES + [('pass', None)])
+        if block.is_legal(action[0], colour):
+            return action[0], action[1], block
+
+
+def _frequencies(sample: Callable[[], Tuple[str, Optional[int], Block]],
+                 n: int) -> Dict[Tuple[str, int], float]:
+    """Return the fraction of <n> moves made by <sample> with each action,
+    keyed by (action, -1), and at each level, keyed by ('level', level).
+
+    Passes are not counted by level, since they are not made on a Block.
+    """
+    counts = {}
+    for _ in range(n):
+        move = sample()
+        keys = [(move[0], -1)]
+        if move[0] != 'pass':
+            keys.append(('level', move[2].level))
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+    return {key: count / n for key, count in counts.items()}
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_random_move_distribution(seed: int) -> None:
+    """_random_move makes each action, and moves at each level, about as
+    often as RandomPlayer did when it retried invalid moves.
+    """
+    random.seed(seed)
+    board = generate_board(4, 750)
+    rng = random.Random(seed)
+    for _ in range(10):
+        move = _random_move(board, COLOUR_LIST[0], rng)
+        move[2].apply_move(move[0], move[1], COLOUR_LIST[0], rng)
+    colour = COLOUR_LIST[1]
+
+    new = _frequencies(lambda: _random_move(board, colour, rng), 10000)
+    old = _frequencies(lambda: _old_random_move(board, colour, rng), 10000)
+    for key in set(new) | set(old):
+        assert abs(new.get(key, 0) - old.get(key, 0)) < 0.02, key
+
+
+@pytest.mark.parametrize('make_player', [
+    lambda goal: SmartPlayer(0, goal, 100),
+    lambda goal: SearchPlayer(0, goal, 3),
+    lambda goal: MCTSPlayer(0, goal)
+])
+def test_generate_move_cancelled(
+        make_player: Callable[[BlobGoal], Player]) -> None:
+    """A player whose move is cancelled before it starts passes without
+    searching.
+    """
+    random.seed(0)
+    board = generate_board(3, 750)
+    player = make_player(BlobGoal(COLOUR_LIST[0]))
+    player.proceed()
+    cancel = threading.Event()
+    cancel.set()
+    move = player.generate_move(board, cancel)
+    assert move[:2] == ('pass', None)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_exact_estimates_not_rescored(
+        seed: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    """With a time budget, a SmartPlayer for a PerimeterGoal only scores the
+    moves whose estimates are not exact, and its move is as good as one
+    chosen without a budget.
+    """
+    random.seed(seed)
+    board = generate_board(3, 750)
+    goal = PerimeterGoal(COLOUR_LIST[0])
+    expected = SmartPlayer(0, goal, 30, seed=seed)
+    expected.proceed()
+    expected_move = expected.generate_move(board)
+
+    scored = []
+
+    def _score_move(*args: object) -> int:
+        scored.append(args[3][0])
+        return score_move(*args)
+
+    monkeypatch.setattr('player.score_move', _score_move)
+    player = SmartPlayer(0, goal, 30, time_budget=60000, seed=seed)
+    player.proceed()
+    move = player.generate_move(board)
+    assert player.moves_scored == expected.moves_scored
+    assert set(scored) <= {'smash'}
+    if 'smash' not in (move[0], expected_move[0]):
+        assert _move_score(board, goal, move) == \
+            _move_score(board, goal, expected_move)
+
+
+@pytest.mark.parametrize('goal', [BlobGoal(COLOUR_LIST[0]),
+                                  PerimeterGoal(COLOUR_LIST[0])])
+def test_tiny_time_budget_scores_a_move(goal: BlobGoal) -> None:
+    """A SmartPlayer scores at least one move, however small its time
+    budget, even when scoring the board itself takes longer than that.
+    """
+    random.seed(0)
+    board = generate_board(4, 750)
+    SCORE_CACHE.clear()
+    player = SmartPlayer(0, goal, 100, time_budget=0.001, seed=0)
+    player.proceed()
+    player.generate_move(board)
+    assert player.moves_scored >= 1
+
+
+@pytest.mark.parametrize('goal', [BlobGoal(COLOUR_LIST[0]),
+                                  PerimeterGoal(COLOUR_LIST[0])])
+def test_search_keeps_time_budget(goal: BlobGoal) -> None:
+    """A SearchPlayer stops soon after its time budget runs out, even when
+    there are too many moves to order in time, and still completes a search
+    one turn ahead.
+    """
+    random.seed(2)
+    board = generate_board(6, 750)
+    SCORE_CACHE.clear()
+    player = SearchPlayer(0, goal, 3, time_budget=20, seed=0,
+                          opponents=[PerimeterGoal(COLOUR_LIST[1])])
+    player.proceed()
+    player.generate_move(board)
+    assert time.monotonic() - player._deadline < 0.05
+    assert player.depth_reached >= 1
+
+
+@pytest.mark.parametrize('goal', [BlobGoal(COLOUR_LIST[0]),
+                                  PerimeterGoal(COLOUR_LIST[2])])
+def test_move_pool_matches_serial(goal: BlobGoal) -> None:
+    """A SmartPlayer that scores its moves with a pool of worker processes
+    chooses the same moves as one that scores them itself, for each seed.
+    """
+    players = []
+    try:
+        for seed in range(3):
+            random.seed(seed)
+            serial = SmartPlayer(0, goal, 50, seed=seed)
+            pooled = SmartPlayer(0, goal, 50, workers=2, seed=seed)
+            players.append(pooled)
+            for _ in range(3):
+                board = generate_board(4, 750)
+                serial.proceed()
+                pooled.proceed()
+                expected = serial.generate_move(board)
+                move = pooled.generate_move(board)
+                assert move[:2] == expected[:2]
+                assert board.path_to(move[2]) == \
+                    board.path_to(expected[2])
+                assert pooled.moves_scored == serial.moves_scored
+    finally:
+        for player in players:
+            player.close()
+
+
+def _move_score(board: Block, goal: PerimeterGoal,
+                move: Tuple[str, Optional[int], Block]) -> int:
+    """Return the score of <goal> after <move> on <board>, less the move's
+    penalty, or the score of <goal> on <board> if <move> is a pass.
+    """
+    if move[0] == 'pass':
+        return goal.score(board)
+    return score_move(board, goal, 0, move, 0, goal.score(board))
+
+
+def _index_of(versions: List[Block], board: Block) -> int:
+    """Return the index of <board> itself, not an equal Block, in <versions>.
+    """
+    return [id(version) for version in versions].index(id(board))
+
+
+if __name__ == '__main__':
+    pytest.main(['a2_test.py'])
@@ -20,8 +20,14 @@ Misha Schwartz, and Jaisie Sin
 === Module Description ===
 
 This file contains the different actions that can be made by a Player.
+
+pygame is only needed for the keys that trigger each action, so this file can
+be imported without it, for example to run games without a display.
 """
-import pygame
+try:
+    import pygame
+except ImportError:
+    pygame = None
 
 # Actions that can be performed in the game
 ROTATE_CLOCKWISE = ('rotate', 1)
@@ -66,7 +72,8 @@ ACTION_PENALTY = {
     PASS: 0
 }
 
-ACTION_KEY = {
+# The key for each action, or no keys if pygame is not available
+ACTION_KEY = {} if pygame is None else {
     ROTATE_CLOCKWISE: pygame.K_d,
     ROTATE_COUNTER_CLOCKWISE: pygame.K_a,
     SWAP_HORIZONTAL: pygame.K_q,
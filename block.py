@@ -22,11 +22,59 @@ Misha Schwartz, and Jaisie Sin
 This file contains the Block class, the main data structure used in the game.
 """
 from __future__ import annotations
-from typing import Optional, Tuple, List
+from typing import Iterator, Optional, Tuple, List
+import itertools
 import random
 import math
 
-from settings import colour_name, COLOUR_LIST
+from settings import colour_name, COLOUR_LIST, COLOUR_INDEX, NO_COLOUR_INDEX
+
+# The eight symmetries of a square are encoded as ints 4 * f + r, meaning
+# reflect left-to-right f times and then rotate clockwise r quarter turns.
+# _TRANSFORM_COMPOSE[g][h] is the symmetry that applies h and then g.
+_TRANSFORM_COMPOSE = [
+    [4 * ((g // 4) ^ (h // 4)) +
+     (g % 4 + (h % 4 if g < 4 else -(h % 4))) % 4 for h in range(8)]
+    for g in range(8)
+]
+# When the symmetry g is applied to a Block, the child at index k afterwards is
+# the child that was at index _TRANSFORM_CHILDREN[g][k] before.
+_TRANSFORM_CHILDREN = [
+    [((k + g % 4) % 4) ^ (g // 4) for k in range(4)] for g in range(8)
+]
+
+# Hashes are 64-bit, and the hash of a parent weights each child's hash by the
+# multiplier for its index.
+_HASH_MASK = (1 << 64) - 1
+_HASH_MULTIPLIERS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F,
+                     0x165667B19E3779F9, 0xD6E8FEB86659FD93]
+
+
+# Bit flags for the actions that can be performed on a Block
+LEGAL_ROTATE, LEGAL_SWAP, LEGAL_SMASH, LEGAL_PAINT, LEGAL_COMBINE = \
+    1, 2, 4, 8, 16
+ACTION_FLAGS = {'rotate': LEGAL_ROTATE, 'swap': LEGAL_SWAP,
+                'smash': LEGAL_SMASH, 'paint': LEGAL_PAINT,
+                'combine': LEGAL_COMBINE}
+# The source of the epochs of the positions of trees of Blocks. Each epoch is
+# used once, so an epoch from one tree never matches another's, and taking the
+# next one is atomic, so trees changed in different threads stay consistent.
+_EPOCHS = itertools.count(1)
+# The directions of the rotate and swap actions
+_DIRECTIONS = {'rotate': [1, 3], 'swap': [0, 1]}
+# The index of the first descent weight among the counts in a Block's _legal
+_WEIGHT_INDEX = 4 + len(COLOUR_LIST)
+
+
+def _mix_hash(value: int) -> int:
+    """Return a well-mixed 64-bit hash of the 64-bit int <value>.
+
+    This is the finalizer of the SplitMix64 generator, so every input bit
+    affects every output bit.
+    """
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _HASH_MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _HASH_MASK
+    return value ^ (value >> 31)
 
 
 def generate_board(max_depth: int, size: int) -> Block:
@@ -61,7 +109,9 @@ class Block:
 
     === Public Attributes ===
     position:
-        The (x, y) coordinates of the upper left corner of this Block.
+        The (x, y) coordinates of the upper left corner of this Block. The
+        position of a child is derived from its parent's when it is read, so
+        rotating or swapping only reorders children.
     size:
         The height and width of this square Block.
     colour:
@@ -77,7 +127,8 @@ class Block:
     children:
         The blocks into which this block is subdivided. The children are
         stored in this order: upper-right child, upper-left child,
-        lower-left child, lower-right child.
+        lower-left child, lower-right child. A rotation of this Block is only
+        applied to its descendants when its children are read.
 
     === Representation Invariants===
     - len(children) == 0 or len(children) == 4
@@ -92,12 +143,56 @@ class Block:
         - its colour is not None.
     - level <= max_depth
     """
-    position: Tuple[int, int]
+    # === Private Attributes ===
+    # _position:
+    #   The position of this Block when it was last derived or set.
+    # _epoch:
+    #   The epoch of this Block's tree when _position was derived, or -1 if it
+    #   has not been.
+    # _tree_epoch:
+    #   If this Block is the root of its tree, the epoch of the positions in the
+    #   tree. It is replaced with a new epoch from _EPOCHS whenever children in
+    #   the tree are reordered or a position is set, so every position derived
+    #   in an older epoch is stale.
+    # _parent:
+    #   The Block that this Block is a child of, or None if it is the root.
+    # _children:
+    #   The children of this Block, before _transform is applied to them.
+    # _transform:
+    #   The symmetry, encoded as for _TRANSFORM_COMPOSE, that still has to be
+    #   applied to this Block's children and their descendants.
+    # _raw_hashes:
+    #   The hash of this Block's structure and colours before _transform is
+    #   applied, under each of the 8 symmetries, or None if it is out of date.
+    #   If a Block's hashes are out of date, so are its ancestors'.
+    # _legal:
+    #   The flags of the actions that can be performed on this Block, and the
+    #   number of Blocks in this Block's subtree, including itself, that can
+    #   be rotated (or swapped), smashed, combined and painted, followed by the
+    #   number of those that can be painted that already have each colour in
+    #   COLOUR_LIST, followed by the sums of the descent weights of the Blocks
+    #   that can be rotated, smashed and combined. This is None if it is out of
+    #   date, and if a Block's is out of date, so are its ancestors'.
+    # _shared:
+    #   True iff this Block may be a child of more than one Block, because a
+    #   version made by persistent_move shares it. A shared Block is never
+    #   changed: each Block that has it as a child copies it first.
+    # _shares_children:
+    #   True iff any of this Block's children may be shared.
     size: int
     colour: Optional[Tuple[int, int, int]]
     level: int
     max_depth: int
-    children: List[Block]
+    _position: Tuple[int, int]
+    _epoch: int
+    _tree_epoch: int
+    _parent: Optional[Block]
+    _children: List[Block]
+    _transform: int
+    _raw_hashes: Optional[Tuple[int, ...]]
+    _legal: Optional[Tuple[int, Tuple[int, ...]]]
+    _shared: bool
+    _shares_children: bool
 
     def __init__(self, position: Tuple[int, int], size: int,
                  colour: Optional[Tuple[int, int, int]], level: int,
@@ -111,12 +206,127 @@ class Block:
             - level >= 0
             - max_depth >= level
         """
-        self.position = position
+        self._position = position
+        self._epoch = -1
+        self._tree_epoch = next(_EPOCHS)
+        self._parent = None
         self.size = size
         self.colour = colour
         self.level = level
         self.max_depth = max_depth
-        self.children = []
+        self._children = []
+        self._transform = 0
+        self._raw_hashes = None
+        self._legal = None
+        self._shared = False
+        self._shares_children = False
+
+    @property
+    def children(self) -> List[Block]:
+        """Return the children of this Block, first applying any rotation of
+        this Block that they have not been given yet, and copying any that are
+        shared with another version of the board.
+        """
+        self._push_transform()
+        if self._shares_children:
+            self._claim_children()
+        return self._children
+
+    @children.setter
+    def children(self, children: List[Block]) -> None:
+        """Replace the children of this Block with <children>.
+        """
+        self._children = children
+        for child in children:
+            child._parent = self
+        self._shares_children = any(child._shared for child in children)
+        self._invalidate_caches()
+
+    def _push_transform(self) -> None:
+        """Apply this Block's pending symmetry to the order of its children,
+        and pass it on to each child to apply to its own children.
+        """
+        if self._transform != 0 and len(self._children) != 0:
+            if self._raw_hashes is not None:
+                self._raw_hashes = self._hashes()
+            transform = self._transform
+            children = self._children
+            self._children = [children[k]
+                              for k in _TRANSFORM_CHILDREN[transform]]
+            if self._shares_children:
+                self._claim_children()
+            for child in self._children:
+                child._transform = \
+                    _TRANSFORM_COMPOSE[transform][child._transform]
+            self._transform = 0
+
+    def _claim_children(self) -> None:
+        """Replace each child of this Block that is shared with a copy that
+        only this Block has, so that it can be changed in place.
+        """
+        for i, child in enumerate(self._children):
+            if child._shared:
+                self._children[i] = child._shallow_copy(self)
+        self._shares_children = False
+
+    def _settle(self) -> None:
+        """Apply to this Block every pending symmetry of its ancestors, so that
+        its children are in the same order as if they had been read from the
+        root.
+
+        This must be done before changing this Block, since a change to the
+        children of this Block does not commute with a symmetry of its
+        ancestors.
+        """
+        ancestors = []
+        ancestor = self._parent
+        while ancestor is not None:
+            ancestors.append(ancestor)
+            ancestor = ancestor._parent
+        for ancestor in reversed(ancestors):
+            ancestor._push_transform()
+
+    @property
+    def position(self) -> Tuple[int, int]:
+        """Return the (x, y) coordinates of the upper left corner of this Block,
+        deriving them from this Block's parent if they may have changed.
+        """
+        parent = self._parent
+        if parent is None:
+            return self._position
+        epoch = self._root()._tree_epoch
+        if self._epoch != epoch:
+            # The parent's position must be derived first, since doing so can
+            # reorder the parent's children.
+            positions = parent._children_positions()
+            for child, position in zip(parent.children, positions):
+                child._position = position
+                child._epoch = epoch
+        return self._position
+
+    @position.setter
+    def position(self, position: Tuple[int, int]) -> None:
+        """Move the upper left corner of this Block, and so the positions of
+        all its descendants, to <position>.
+        """
+        self._position = position
+        self._epoch = self._new_epoch()
+
+    def _root(self) -> Block:
+        """Return the root of the tree that this Block is in.
+        """
+        block = self
+        while block._parent is not None:
+            block = block._parent
+        return block
+
+    def _new_epoch(self) -> int:
+        """Start a new epoch of the positions in the tree that this Block is
+        in, so that every position derived before is stale, and return it.
+        """
+        root = self._root()
+        root._tree_epoch = next(_EPOCHS)
+        return root._tree_epoch
 
     def __str__(self) -> str:
         """Return this Block in a string format.
@@ -140,11 +350,280 @@ class Block:
 
             return result
 
+    def _invalidate_caches(self) -> None:
+        """Record that the hashes and legal moves of this Block and its
+        ancestors are out of date.
+        """
+        block = self
+        while block is not None and (block._raw_hashes is not None or
+                                     block._legal is not None):
+            block._raw_hashes = None
+            block._legal = None
+            block = block._parent
+
+    def _legal_summary(self) -> Tuple[int, Tuple[int, ...]]:
+        """Return the flags of the actions that can be performed on this Block
+        and the counts of legal moves in its subtree, as described for _legal.
+
+        Only the summaries that are out of date are recomputed, so after a
+        move this takes time proportional to the depth of the moved Block.
+        """
+        if self._legal is None:
+            counts = [0] * (_WEIGHT_INDEX + 3)
+            if self.colour is None:
+                flags = LEGAL_ROTATE | LEGAL_SWAP
+                counts[0] = 1
+                counts[_WEIGHT_INDEX] = self.descent_weight()
+                if self.combinable():
+                    flags |= LEGAL_COMBINE
+                    counts[2] = 1
+                    counts[_WEIGHT_INDEX + 2] = self.descent_weight()
+                for child in self._children:
+                    for i, count in enumerate(child._legal_summary()[1]):
+                        counts[i] += count
+            elif self.level != self.max_depth:
+                flags = LEGAL_SMASH
+                counts[1] = 1
+                counts[_WEIGHT_INDEX + 1] = self.descent_weight()
+            else:
+                flags = LEGAL_PAINT
+                counts[3] = 1
+                if self.colour in COLOUR_INDEX:
+                    counts[4 + COLOUR_INDEX[self.colour]] = 1
+            self._legal = (flags, tuple(counts))
+        return self._legal
+
+    def legal_actions(self) -> int:
+        """Return the bitwise or of the flags in ACTION_FLAGS of the actions
+        that can be performed on this Block.
+
+        Paint is included if this Block can be painted some colour. This is
+        kept up to date as the tree changes, so it is read in constant time.
+        """
+        return self._legal_summary()[0]
+
+    def is_legal(self, action: str,
+                 colour: Optional[Tuple[int, int, int]] = None) -> bool:
+        """Return True iff the action named <action>, as for apply_move, can
+        be performed on this Block, painting with <colour>.
+
+        Nothing is performed or copied to decide this.
+        """
+        if action == 'pass':
+            return True
+        if action == 'paint' and colour == self.colour:
+            return False
+        return bool(self.legal_actions() & ACTION_FLAGS.get(action, 0))
+
+    def legal_block_count(self, action: str,
+                          colour: Optional[Tuple[int, int, int]] = None) -> int:
+        """Return the number of Blocks, this Block or within it, on which the
+        action named <action>, other than pass, can be performed, painting with
+        <colour>.
+        """
+        counts = self._legal_summary()[1]
+        if action in ['rotate', 'swap']:
+            return counts[0]
+        elif action == 'smash':
+            return counts[1]
+        elif action == 'combine':
+            return counts[2]
+        elif action == 'paint' and colour in COLOUR_INDEX:
+            return counts[3] - counts[4 + COLOUR_INDEX[colour]]
+        elif action == 'paint':
+            return counts[3]
+        return 0
+
+    def descent_weight(self) -> int:
+        """Return the weight of this Block in a random descent from the root,
+        which picks a level uniformly at random, and then picks children
+        uniformly at random until it reaches that level or a Block with no
+        children.
+
+        The chance that the descent stops at this Block is its weight divided
+        by 4 ** max_depth * (max_depth + 1), so the weights of the Blocks of a
+        board sum to that.
+        """
+        weight = 4 ** (self.max_depth - self.level)
+        if self.colour is not None:
+            weight *= self.max_depth - self.level + 1
+        return weight
+
+    def legal_block_weight(self, action: str,
+                           colour: Optional[Tuple[int, int, int]] = None) -> \
+            int:
+        """Return the sum of the descent weights of the Blocks, this Block or
+        within it, on which the action named <action>, other than pass, can be
+        performed, painting with <colour>.
+
+        Only Blocks at max_depth can be painted, so their weights are all 1.
+        """
+        counts = self._legal_summary()[1]
+        if action in ['rotate', 'swap']:
+            return counts[_WEIGHT_INDEX]
+        elif action == 'smash':
+            return counts[_WEIGHT_INDEX + 1]
+        elif action == 'combine':
+            return counts[_WEIGHT_INDEX + 2]
+        return self.legal_block_count(action, colour)
+
+    def random_legal_block(self, action: str,
+                           colour: Optional[Tuple[int, int, int]] = None,
+                           rng: random.Random = random,
+                           weighted: bool = False) -> Optional[Block]:
+        """Return a Block, this Block or within it, on which the action named
+        <action>, other than pass, can be performed, painting with <colour>,
+        chosen at random using <rng>. Return None if there is no such Block.
+
+        The Block is chosen uniformly, or in proportion to its descent weight
+        if <weighted> is True. It is found by descending from this Block using
+        the counts or weights of legal Blocks in each subtree, so nothing is
+        copied or retried.
+        """
+        total = self.legal_block_weight(action, colour) if weighted else \
+            self.legal_block_count(action, colour)
+        if total == 0:
+            return None
+        index = rng.randrange(total)
+        block = self
+        while True:
+            if block.is_legal(action, colour):
+                own = block.descent_weight() if weighted else 1
+                if index < own:
+                    return block
+                index -= own
+            for child in block.children:
+                count = child.legal_block_weight(action, colour) \
+                    if weighted else child.legal_block_count(action, colour)
+                if index < count:
+                    block = child
+                    break
+                index -= count
+
+    def legal_move_count(self, colour: Tuple[int, int, int]) -> int:
+        """Return the number of moves, other than pass, that can be performed
+        on this Block or any Block within it, painting with <colour>.
+
+        Rotating and swapping each count once for each of their two directions.
+        """
+        counts = self._legal_summary()[1]
+        total = 4 * counts[0] + counts[1] + counts[2] + counts[3]
+        if colour in COLOUR_INDEX:
+            total -= counts[4 + COLOUR_INDEX[colour]]
+        return total
+
+    def legal_move(self, colour: Tuple[int, int, int], index: int) -> \
+            Tuple[str, Optional[int], Block]:
+        """Return the move at <index> among the moves, other than pass, that
+        can be performed on this Block or any Block within it, painting with
+        <colour>, numbered in preorder of their Blocks.
+
+        The move is a tuple (action, direction, block), as made by a Player.
+        The Block is found by descending from this Block using the counts of
+        legal moves in each subtree, so nothing is copied or enumerated.
+
+        Precondition: 0 <= index < self.legal_move_count(colour)
+        """
+        block = self
+        while True:
+            moves = []
+            flags = block.legal_actions()
+            for action in ['rotate', 'swap']:
+                if flags & ACTION_FLAGS[action]:
+                    moves.extend((action, d) for d in _DIRECTIONS[action])
+            for action in ['smash', 'combine']:
+                if flags & ACTION_FLAGS[action]:
+                    moves.append((action, None))
+            if block.is_legal('paint', colour):
+                moves.append(('paint', None))
+            if index < len(moves):
+                return moves[index][0], moves[index][1], block
+            index -= len(moves)
+            for child in block.children:
+                count = child.legal_move_count(colour)
+                if index < count:
+                    block = child
+                    break
+                index -= count
+
+    def _hashes(self) -> Tuple[int, ...]:
+        """Return the hash of this Block under each of the 8 symmetries.
+
+        The hash at index t is the hash of the structure, levels and colours of
+        this Block after the symmetry t, encoded as for _TRANSFORM_COMPOSE, is
+        applied to it. Only the hashes that are out of date are recomputed.
+        """
+        if self._raw_hashes is None:
+            if len(self._children) == 0:
+                colour = self.colour
+                key = 1 << 60 if colour is None else \
+                    (2 << 60) | (colour[0] << 16) | (colour[1] << 8) | colour[2]
+                leaf = _mix_hash(key | (self.max_depth << 32) |
+                                 (self.level << 24))
+                self._raw_hashes = (leaf,) * 8
+            else:
+                child_hashes = [child._hashes() for child in self._children]
+                key = (3 << 60) | (self.max_depth << 32) | (self.level << 24)
+                raw_hashes = []
+                for t in range(8):
+                    total = key
+                    for k, i in enumerate(_TRANSFORM_CHILDREN[t]):
+                        total += child_hashes[i][t] * _HASH_MULTIPLIERS[k]
+                    raw_hashes.append(_mix_hash(total & _HASH_MASK))
+                self._raw_hashes = tuple(raw_hashes)
+        if self._transform == 0 or len(self._children) == 0:
+            return self._raw_hashes
+        return tuple(self._raw_hashes[_TRANSFORM_COMPOSE[t][self._transform]]
+                     for t in range(8))
+
+    def update_caches(self) -> Iterator[None]:
+        """Bring the hashes and legal moves of this Block and every Block
+        within it up to date, one Block at a time, yielding None after each.
+
+        Only the Blocks that are out of date are visited, so this does the same
+        work as __hash__ and legal_actions would, but it can be paused after
+        any Block.
+        """
+        stack = [(self, False)]
+        while stack:
+            block, children_done = stack.pop()
+            if block._raw_hashes is not None and block._legal is not None:
+                continue
+            if children_done or len(block._children) == 0:
+                block._hashes()
+                block._legal_summary()
+                yield None
+            else:
+                stack.append((block, True))
+                stack.extend((child, False) for child in block._children)
+
+    def __hash__(self) -> int:
+        """Return a hash of the structure, levels and colours of this Block and
+        all its descendents, based on its 64-bit hash.
+
+        The hash is kept up to date incrementally: after a move, only the
+        hashes of the changed Block and its ancestors are recomputed.
+        """
+        return self._hashes()[0]
+
+    def canonical_key(self) -> int:
+        """Return a 64-bit key for this Block that is the same for every
+        rotation and reflection of it.
+
+        Goals score all eight rotations and reflections of a board the same, so
+        this can key caches of scores. No copies are made: the hashes of this
+        Block under each symmetry are already kept up to date.
+        """
+        return min(self._hashes())
+
     def __eq__(self, other: Block) -> bool:
         """Return True iff this Block and all its descendents are equivalent to
         the <other> Block and all its descendents.
         """
-        if len(self.children) == 0 and len(other.children) == 0:
+        if hash(self) != hash(other):
+            # Equivalent Blocks always have the same hash.
+            return False
+        elif len(self.children) == 0 and len(other.children) == 0:
             # Both self and other are leaves.
             return self.position == other.position and \
                    self.size == other.size and \
@@ -180,23 +659,6 @@ class Block:
 
         return [(x + size, y), (x, y), (x, y + size), (x + size, y + size)]
 
-    def _update_children_positions(self, position: Tuple[int, int]) -> None:
-        """Set the position of this Block to <position> and update all its
-        descendants to have positions consistent with this Block's.
-
-        <position> is the (x, y) coordinates of the upper-left corner of this
-        Block.
-        """
-        # Reviewed 17/03/2020
-        self.position = position
-        if self.colour is None:
-            cp_list = self._children_positions()
-            for i in range(4):
-                if self.children[i].colour is None:
-                    self.children[i]._update_children_positions(cp_list[i])
-                else:
-                    self.children[i].position = cp_list[i]
-
     def smashable(self) -> bool:
         """Return True iff this block can be smashed.
 
@@ -205,25 +667,38 @@ class Block:
         """
         return self.level != self.max_depth and len(self.children) == 0
 
-    def smash(self) -> bool:
+    def combinable(self) -> bool:
+        """Return True iff this block can be combined.
+
+        A block can be combined if it has children, its level is
+        max_depth - 1 and its children have a majority colour.
+        """
+        return self.level == self.max_depth - 1 and self.colour is None \
+            and self._helper_combine() is not None
+
+    def smash(self, rng: random.Random = random) -> bool:
         """Sub-divide this block so that it has four randomly generated
-        children.
+        children, using <rng> as the source of randomness.
 
         If this Block's level is <max_depth>, do nothing. If this block has
-        children, do nothing.
+        children, do nothing. Do nothing if this Block is frozen, as described for persistent_move.
 
         Return True iff the smash was performed.
         """
         # Reviewed 17/03/2020
-        if self.smashable():
+        if self.smashable() and not self._frozen():
+            self._settle()
+            self._invalidate_caches()
             self.colour = None
+            self._transform = 0
             size = self._child_size()
             level = self.level + 1
             for cp in self._children_positions():
-                colour = random.choice(COLOUR_LIST)
+                colour = rng.choice(COLOUR_LIST)
                 child = Block(cp, size, colour, level, self.max_depth)
-                if random.random() < math.exp(-0.25 * child.level):
-                    child.smash()
+                child._parent = self
+                if rng.random() < math.exp(-0.25 * child.level):
+                    child.smash(rng)
                 self.children.append(child)
             return True
         else:
@@ -234,23 +709,26 @@ class Block:
 
         If this Block has no children, do nothing. Otherwise, if <direction> is
         1, swap vertically. If <direction> is 0, swap horizontally.
+        Do nothing if this Block is frozen, as described for persistent_move.
 
         Return True iff the swap was performed.
 
         Precondition: <direction> is either 0 or 1
         """
         # Reviewed 17/03/2020
-        if self.colour is not None:
+        if self.colour is not None or self._frozen():
             return False
         else:
+            self._settle()
             i = 0
             j = -1 if direction == 1 else 1
             # Ref stackoverflow.com/questions/2802726
             while i <= 2:
                 self.children[i], self.children[i + j] = \
                     self.children[i + j], self.children[i]
-                self._update_children_positions(self.position)
                 i += 2
+            self._new_epoch()
+            self._invalidate_caches()
             return True
 
     def rotate(self, direction: int) -> bool:
@@ -259,34 +737,38 @@ class Block:
         If this Block has no children, do nothing. If <direction> is 1, rotate
         clockwise. If <direction> is 3, rotate counter-clockwise.
 
+        The rotation takes constant time: the children of each descendant are
+        only reordered when they are next read. Do nothing if this Block is frozen, as described for persistent_move.
+
         Return True iff the rotate was performed.
 
         Precondition: <direction> is either 1 or 3.
         """
         # Reviewed 17/03/2020
-        if self.colour is not None:
+        if self.colour is not None or self._frozen():
             return False
         else:
-            self.children[-2 + direction], self.children[-1 + direction], \
-                self.children[0 + direction], self.children[-3 + direction] = \
-                self.children[0], self.children[1], \
-                self.children[2], self.children[3]
-            self._update_children_positions(self.position)
-            for child in self.children:
-                child.rotate(direction)
+            self._settle()
+            self._transform = _TRANSFORM_COMPOSE[direction][self._transform]
+            self._new_epoch()
+            if self._parent is not None:
+                # This Block's own hashes account for its pending rotation
+                self._parent._invalidate_caches()
             return True
 
     def paint(self, colour: Tuple[int, int, int]) -> bool:
         """Change this Block's colour iff it is a leaf at a level of max_depth
-        and its colour is different from <colour>.
+        and its colour is different from <colour>. Do nothing if this Block is frozen, as described for persistent_move.
 
         Return True iff this Block's colour was changed.
         """
         # Reviewed 17/03/2020
-        if self.level != self.max_depth or colour == self.colour:
+        if self.level != self.max_depth or colour == self.colour or \
+                self._frozen():
             return False
         else:
             self.colour = colour
+            self._invalidate_caches()
             return True
 
     def combine(self) -> bool:
@@ -299,11 +781,13 @@ class Block:
 
         If there is no majority colour, do nothing. If this block is not at a
         level of max_depth - 1, or this block has no children, do nothing.
+        Do nothing if this Block is frozen, as described for persistent_move.
 
         Return True iff this Block was turned into a leaf node.
         """
         # Reviewed 17/03/2020
-        if self.level != self.max_depth - 1 or self.colour is not None:
+        if self.level != self.max_depth - 1 or self.colour is not None or \
+                self._frozen():
             return False
         else:
             colour = self._helper_combine()
@@ -312,6 +796,7 @@ class Block:
             else:
                 self.children = []  # Kill all my children D:
                 self.colour = colour
+                self._invalidate_caches()
                 return True
 
     def _helper_combine(self) -> Optional[Tuple]:
@@ -344,11 +829,258 @@ class Block:
         #  Reviewed 17/03/2020
         copy = Block(self.position, self.size,
                      self.colour, self.level, self.max_depth)
-        if self.colour is None:
-            for child in self.children:
-                copy.children.append(child.create_copy())
+        self._copy_into(copy)
+        return copy
+
+    def _copy_into(self, copy: Block) -> None:
+        """Give <copy>, a new Block like this one, this Block's pending
+        symmetry and caches, and deep copies of its children.
+
+        The positions of the children are not read, since reading one can apply
+        this Block's pending symmetry to its children while they are copied.
+        The copies derive their positions from <copy> instead.
+        """
+        copy._transform = self._transform
+        copy._raw_hashes = self._raw_hashes
+        copy._legal = self._legal
+        for child in self._children:
+            child_copy = Block(child._position, child.size, child.colour,
+                               child.level, child.max_depth)
+            child_copy._parent = copy
+            child._copy_into(child_copy)
+            copy._children.append(child_copy)
+
+    def encode(self) -> EncodedBlock:
+        """Return a compact encoding of this Block, from which decode_block
+        can make an equal Block.
+
+        Precondition: every undivided Block within this Block has a colour in
+        COLOUR_LIST.
+        """
+        cells = bytearray()
+        stack = [self]
+        while stack:
+            block = stack.pop()
+            if block.colour is None:
+                cells.append(NO_COLOUR_INDEX)
+                stack.extend(reversed(block.children))
+            else:
+                cells.append(COLOUR_INDEX[block.colour])
+        return self.position, self.size, self.level, self.max_depth, \
+            bytes(cells)
+
+    def _frozen(self) -> bool:
+        """Return True iff this Block is, or is within, a Block shared by
+        more than one version of a board, so that changing it would change
+        every version.
+
+        Only a Block read before persistent_move shared it can be frozen, since
+        reading a shared Block's parent's children copies it.
+        """
+        block = self
+        while block is not None:
+            if block._shared:
+                return True
+            block = block._parent
+        return False
+
+    def _shallow_copy(self, parent: Optional[Block]) -> Block:
+        """Return a new Block that is a copy of this Block, as a child of
+        <parent>, but that shares its children with this Block.
+
+        The children are marked as shared, so that neither Block changes them.
+        """
+        copy = Block(self._position, self.size,
+                     self.colour, self.level, self.max_depth)
+        copy._parent = parent
+        copy._children = list(self._children)
+        copy._transform = self._transform
+        copy._raw_hashes = self._raw_hashes
+        copy._legal = self._legal
+        for child in copy._children:
+            child._shared = True
+        copy._shares_children = len(copy._children) != 0
+        self._shares_children = copy._shares_children
         return copy
 
+    def path_to(self, block: Block) -> Optional[List[int]]:
+        """Return the indices of the children to follow from this Block to
+        reach <block>, or None if <block> is not within this Block.
+
+        The path is found by following parents up from <block>, since pixel
+        positions are rounded at every level and so do not always place a
+        Block within the right child.
+        """
+        block._settle()
+        path = []
+        current = block
+        while current is not self:
+            parent = current._parent
+            if parent is None:
+                return None
+            for i, child in enumerate(parent._children):
+                if child is current:
+                    path.append(i)
+                    break
+            else:
+                return None
+            current = parent
+        path.reverse()
+        return path
+
+    def follow_path(self, path: List[int]) -> Optional[Block]:
+        """Return the Block reached by following the indices of children in
+        <path> from this Block, as returned by path_to, or None if there is no
+        such Block.
+        """
+        block = self
+        for i in path:
+            if len(block.children) == 0:
+                return None
+            block = block.children[i]
+        return block
+
+    def persistent_move(self, block: Block, action: str,
+                        direction: Optional[int] = None,
+                        colour: Optional[Tuple[int, int, int]] = None) -> \
+            Optional[Block]:
+        """Return a new version of this Block in which the action named
+        <action> has been performed on <block>, without mutating this Block.
+
+        <action>, <direction> and <colour> are as for apply_move. Return None
+        if <block> is not within this Block or the action could not be
+        performed.
+
+        The new version shares every subtree that the move does not touch with
+        this Block: only <block> and its ancestors are copied, and a rotation
+        is left pending on the copy of <block>, so the move takes time and
+        memory proportional to the depth of <block>. Either version can then be
+        changed in place like any other board without affecting the other,
+        since each copies a shared Block the first time it reads it.
+
+        A Block read from this Block before the call stays part of this Block,
+        unless the new version shares it. A shared Block is frozen: its
+        mutators do nothing and return False, since they would change both
+        versions. It can be read again from this Block, as a copy that can be
+        changed.
+        """
+        path = self.path_to(block)
+        if path is None or not block.is_legal(action, colour):
+            return None
+        new_block = block._shallow_copy(None)
+        new_block.apply_move(action, direction, colour)
+
+        ancestors = [self]
+        for i in path[:-1]:
+            ancestors.append(ancestors[-1].children[i])
+        for ancestor, i in zip(reversed(ancestors), reversed(path)):
+            # The child being replaced stays in this version only
+            replaced = ancestor._children[i]
+            shared = replaced._shared
+            copy = ancestor._shallow_copy(None)
+            replaced._shared = shared
+            copy._children[i] = new_block
+            copy._raw_hashes = None
+            copy._legal = None
+            new_block._parent = copy
+            new_block = copy
+        return new_block
+
+    def apply_move(self, action: str, direction: Optional[int] = None,
+                   colour: Optional[Tuple[int, int, int]] = None,
+                   rng: random.Random = random) -> Optional[Undo]:
+        """Perform the action named <action> on this Block and return a token
+        that undo_move can use to restore this Block to its exact prior state.
+
+        <action> is one of 'rotate', 'swap', 'smash', 'paint', 'combine' or
+        'pass'. <direction> is the direction for 'rotate' and 'swap',
+        <colour> is the colour for 'paint', and <rng> is the source of
+        randomness for 'smash'.
+
+        Return None, and leave this Block unchanged, iff the action could not
+        be performed.
+        """
+        self._settle()
+        # Rotating and swapping are undone by moving back, so the children are
+        # only read, which would apply a pending rotation, for other actions
+        children = [] if action in ['rotate', 'swap'] else list(self.children)
+        undo = (self, action, direction, self.colour, children,
+                self._transform)
+        success = False
+        if action == 'rotate':
+            success = self.rotate(direction)
+        elif action == 'swap':
+            success = self.swap(direction)
+        elif action == 'smash':
+            success = self.smash(rng)
+        elif action == 'paint':
+            success = self.paint(colour)
+        elif action == 'combine':
+            success = self.combine()
+        elif action == 'pass':
+            success = True
+        return undo if success else None
+
+
+# A token for undoing a move made by Block.apply_move. It stores the Block that
+# was changed, the action and direction of the move, and the colour, children
+# and pending rotation that the Block had before the move. The children are
+# only stored for moves other than rotate and swap.
+Undo = Tuple[Block, str, Optional[int], Optional[Tuple[int, int, int]],
+             List[Block], int]
+
+
+# The encoding of a Block made by Block.encode. It stores the Block's position,
+# size, level and max_depth, and the index in COLOUR_LIST of the colour of every
+# Block within it in preorder, where NO_COLOUR_INDEX marks a Block that is
+# followed by the encodings of its four children.
+EncodedBlock = Tuple[Tuple[int, int], int, int, int, bytes]
+
+
+def decode_block(encoded: EncodedBlock) -> Block:
+    """Return a new Block equal to the Block that Block.encode encoded as
+    <encoded>.
+    """
+    position, size, level, max_depth, cells = encoded
+    if cells[0] != NO_COLOUR_INDEX:
+        return Block(position, size, COLOUR_LIST[cells[0]], level, max_depth)
+    root = Block(position, size, None, level, max_depth)
+    # The Blocks whose children are still being decoded, and those children
+    stack = [(root, [])]
+    for cell in cells[1:]:
+        parent, children = stack[-1]
+        colour = None if cell == NO_COLOUR_INDEX else COLOUR_LIST[cell]
+        child = Block(parent._children_positions()[len(children)],
+                      parent._child_size(), colour, parent.level + 1,
+                      max_depth)
+        children.append(child)
+        if colour is None:
+            stack.append((child, []))
+        while stack and len(stack[-1][1]) == 4:
+            parent, children = stack.pop()
+            parent.children = children
+    return root
+
+
+def undo_move(undo: Undo) -> None:
+    """Restore the Block changed by a move to its state before the move, given
+    the <undo> token that Block.apply_move returned for it.
+
+    Moves must be undone in the reverse of the order in which they were made.
+    """
+    block, action, direction, colour, children, transform = undo
+    block._settle()
+    if action == 'rotate':
+        block.rotate(4 - direction)
+    elif action == 'swap':
+        # Swapping twice in the same direction undoes the swap
+        block.swap(direction)
+    elif action in ['smash', 'paint', 'combine']:
+        block.colour = colour
+        block.children = children
+        block._transform = transform
+        block._invalidate_caches()
+
 
 if __name__ == '__main__':
     import python_ta
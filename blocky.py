@@ -23,13 +23,14 @@ This file contains the different game states for the Blocky game.
 """
 
 from __future__ import annotations
-from typing import Dict, List, Optional, Tuple
+import threading
+from typing import List, Optional, Tuple
 import pygame
 
-from actions import ACTION_MESSAGE, ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE,\
-    SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PASS, PAINT, COMBINE, ACTION_PENALTY
+from actions import ACTION_MESSAGE
 from block import Block
-from player import Player
+from gamedata import GameData
+from player import HumanPlayer, Player
 from renderer import Renderer
 from settings import ANIMATION_DURATION
 
@@ -58,67 +59,71 @@ def _block_to_squares(board: Block) -> List[Tuple[Tuple[int, int, int],
     return out_list
 
 
-class GameData:
-    """
-    A bundle of the data needed for a Blocky game.
-
-    === Public Attributes ===
-    max_turns:
-        The maximum number of turns for the game.
-    board:
-        The Blocky board on which this game will be played.
-    players:
-        The entities that are playing this game.
-    smashes:
-        The number of smashes done by each player.
-    combines:
-        The number of combines done by each player.
-    paints:
-        The number of paints done by each player.
-
-    === Representation Invariants ===
-    - len(players) >= 1
+class MoveWorker:
+    """A background thread in which a player generates a move on a copy of
+    the board, so that the game can keep running while the player thinks.
+
+    The move is mapped back onto the real board, by the path to its Block, when
+    it is collected.
     """
-    max_turns: int
-    board: Block
-    players: List[Player]
-    smashes: Dict[int, int]
-    combines: Dict[int, int]
-    paints: Dict[int, int]
-
-    def __init__(self, board: Block, players: List[Player]) -> None:
-        """Initialize the game data, saving a reference to <board> and
-        <players>.
-
-        Precondition:
-            - len(players) >= 1
+    # === Private Attributes ===
+    # _board:
+    #   The real board.
+    # _copy:
+    #   The copy of the board that the player generates its move on.
+    # _move:
+    #   The move that the player generated on _copy, or None if it has not
+    #   finished or made no move.
+    # _thread:
+    #   The thread in which the player generates its move.
+    # _cancel:
+    #   The event that is set when the move is no longer wanted, which the
+    #   player checks as it generates the move.
+    _board: Block
+    _copy: Block
+    _move: Optional[Tuple[str, Optional[int], Block]]
+    _thread: threading.Thread
+    _cancel: threading.Event
+
+    def __init__(self, player: Player, board: Block) -> None:
+        """Initialize this MoveWorker and start <player> generating a move
+        for <board>.
         """
-        self.max_turns = 0
-        self.board = board
-        self.players = players
-
-        self.smashes = {}
-        self.combines = {}
-        self.paints = {}
-
-        # Start off all counts at 0
-        for player in players:
-            self.smashes[player.id] = 0
-            self.combines[player.id] = 0
-            self.paints[player.id] = 0
-
-    def calculate_score(self, player_id: int) -> Tuple[int, int]:
-        """Return a tuple containing first the <player_id>'s score based on
-        their goal in the game and second the deductions from their score based
-        on the actions they've taken.
+        self._board = board
+        self._copy = board.create_copy()
+        self._move = None
+        self._cancel = threading.Event()
+        # A daemon thread does not keep the program running once it quits
+        self._thread = threading.Thread(target=self._run, args=(player,),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, player: Player) -> None:
+        """Generate <player>'s move on the copy of the board.
         """
-        goal_score = self.players[player_id].goal.score(self.board)
+        self._move = player.generate_move(self._copy, self._cancel)
 
-        penalty = self.smashes[player_id] * ACTION_PENALTY[SMASH] + \
-                  self.combines[player_id] * ACTION_PENALTY[COMBINE] + \
-                  self.paints[player_id] * ACTION_PENALTY[PAINT]
+    def done(self) -> bool:
+        """Return True iff the player has finished generating its move.
+        """
+        return not self._thread.is_alive()
+
+    def result(self) -> Optional[Tuple[str, Optional[int], Block]]:
+        """Return the move that the player generated, on the real board, or
+        None if it made no move or this MoveWorker was cancelled.
 
-        return goal_score, penalty
+        Precondition: self.done()
+        """
+        if self._cancel.is_set() or self._move is None:
+            return None
+        block = self._board.follow_path(self._copy.path_to(self._move[2]))
+        return self._move[0], self._move[1], block
+
+    def cancel(self) -> None:
+        """Record that the move is no longer wanted, so that the player stops
+        generating it as soon as it can, and it is discarded.
+        """
+        self._cancel.set()
 
 
 class GameState:
@@ -142,6 +147,11 @@ class GameState:
         """
         raise NotImplementedError
 
+    def cancel(self) -> None:
+        """Stop any work that this GameState is doing in the background.
+        """
+        return
+
 
 class MainState(GameState):
     """A GameState that manages the moves made by different players in Blocky.
@@ -155,10 +165,14 @@ class MainState(GameState):
     #   The index of the current player in GameData.players.
     # _current_score:
     #   The score of the current player, including penalties.
+    # _worker:
+    #   The MoveWorker in which the current player is generating its move, or
+    #   None if it is not generating one in the background.
     _turn: int
     _data: GameData
     _current_player_index: int
     _current_score: int
+    _worker: Optional[MoveWorker]
 
     def __init__(self, data: GameData) -> None:
         """Initialize this GameState.
@@ -166,6 +180,7 @@ class MainState(GameState):
         self._turn = 0
         self._data = data
         self._current_player_index = 0
+        self._worker = None
 
         score, penalty = self._data.calculate_score(self._current_player().id)
         self._current_score = score - penalty
@@ -190,28 +205,7 @@ class MainState(GameState):
     def _do_move(self, move: Tuple[str, Optional[int], Block]) -> bool:
         """Attempt to do the player's requested move.
         """
-        action = (move[0], move[1])
-        direction = move[1]
-        block = move[2]
-        player = self._current_player()
-        move_successful = False
-
-        if action in [ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE]:
-            move_successful = block.rotate(direction)
-        elif action in [SWAP_HORIZONTAL, SWAP_VERTICAL]:
-            move_successful = block.swap(direction)
-        elif action == SMASH:
-            move_successful = block.smash()
-            self._data.smashes[player.id] += int(move_successful)
-        elif action == PAINT:
-            move_successful = block.paint(self._current_player().goal.colour)
-            self._data.paints[player.id] += int(move_successful)
-        elif action == COMBINE:
-            move_successful = block.combine()
-            self._data.combines[player.id] += int(move_successful)
-        elif action == PASS:
-            # Do nothing
-            move_successful = True
+        move_successful = self._data.apply_move(self._current_player(), move)
 
         if move_successful:
             self._update_player()
@@ -223,10 +217,11 @@ class MainState(GameState):
 
     def update(self) -> GameState:
         if self._turn >= self._data.max_turns:
+            self._data.close()
             return GameOverState(self._data)
 
         # Ask the player to make a move
-        move = self._current_player().generate_move(self._data.board)
+        move = self._generate_move()
 
         if move is None:
             # No move was made, stay in the current state
@@ -245,6 +240,32 @@ class MainState(GameState):
                 # The move was not valid, let the player try again
                 return self
 
+    def _generate_move(self) -> Optional[Tuple[str, Optional[int], Block]]:
+        """Return the current player's move, or None if it has not made one
+        yet.
+
+        Human players generate their moves here, from their input, and so do
+        resumable players, a slice at a time. Other players think in a
+        MoveWorker, which is polled on each update.
+        """
+        player = self._current_player()
+        if isinstance(player, HumanPlayer) or player.is_resumable():
+            return player.generate_move(self._data.board)
+        if self._worker is None:
+            if not player.is_ready():
+                return None
+            self._worker = MoveWorker(player, self._data.board)
+        if not self._worker.done():
+            return None
+        move = self._worker.result()
+        self._worker = None
+        return move
+
+    def cancel(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
     def render(self, renderer: Renderer) -> None:
         renderer.draw_board(_block_to_squares(self._data.board))
 
@@ -255,6 +276,8 @@ class MainState(GameState):
         p = self._current_player()
         status = f'Turn {self._turn} | Player {p.id} | ' \
                  f'Score {self._current_score} | {p.goal.description()}'
+        if self._worker is not None:
+            status = f'Turn {self._turn} | Player {p.id} is thinking...'
         renderer.draw_status(status)
 
 
@@ -336,8 +359,8 @@ class GameOverState(GameState):
         """Initialize this GameState.
         """
         self._scores = []
-        for p in data.players:
-            goal_score, penalty = data.calculate_score(p.id)
+        for p, (goal_score, penalty) in zip(data.players,
+                                            data.calculate_scores()):
             self._scores.append((p.id, goal_score, penalty))
 
         self._winner = max(self._scores, key=lambda item: item[1] - item[2])[0]
@@ -372,7 +395,8 @@ if __name__ == '__main__':
         'allowed-io': ['run_game'],
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing', 'pygame', '__future__',
-            'block', 'player', 'renderer', 'settings', 'actions'
+            'threading',
+            'block', 'gamedata', 'player', 'renderer', 'settings', 'actions'
         ],
         'generated-members': 'pygame.*'
     })
@@ -29,7 +29,8 @@ from typing import List
 import pygame
 
 from block import generate_board
-from blocky import GameData, GameState, MainState
+from blocky import GameState, MainState
+from gamedata import GameData
 from player import create_players
 from renderer import Renderer
 from settings import BOARD_SIZE
@@ -77,6 +78,9 @@ class Game:
             # Process events
             for e in pygame.event.get():
                 if e.type == pygame.QUIT:
+                    # Stop waiting for any move being generated
+                    self._state.cancel()
+                    self._data.close()
                     return
                 else:
                     self._state.process_event(e)
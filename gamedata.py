@@ -0,0 +1,160 @@
+"""CSC148 Assignment 2
+
+=== CSC148 Winter 2020 ===
+Department of Computer Science,
+University of Toronto
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+Authors: Diane Horton, David Liu, Mario Badr, Sophia Huynh, Misha Schwartz,
+and Jaisie Sin
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) Diane Horton, David Liu, Mario Badr, Sophia Huynh,
+Misha Schwartz, and Jaisie Sin
+
+=== Module Description ===
+
+This file contains the GameData class, the data shared by the states of a Blocky
+game. It does not need a display, so it is also used to run games without one.
+"""
+
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+
+from actions import ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE, \
+    SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PASS, PAINT, COMBINE, ACTION_PENALTY
+from block import Block
+from goal import score_all
+from player import Player
+
+
+class GameData:
+    """
+    A bundle of the data needed for a Blocky game.
+
+    === Public Attributes ===
+    max_turns:
+        The maximum number of turns for the game.
+    board:
+        The Blocky board on which this game will be played.
+    players:
+        The entities that are playing this game.
+    smashes:
+        The number of smashes done by each player.
+    combines:
+        The number of combines done by each player.
+    paints:
+        The number of paints done by each player.
+
+    === Representation Invariants ===
+    - len(players) >= 1
+    """
+    max_turns: int
+    board: Block
+    players: List[Player]
+    smashes: Dict[int, int]
+    combines: Dict[int, int]
+    paints: Dict[int, int]
+
+    def __init__(self, board: Block, players: List[Player]) -> None:
+        """Initialize the game data, saving a reference to <board> and
+        <players>.
+
+        Precondition:
+            - len(players) >= 1
+        """
+        self.max_turns = 0
+        self.board = board
+        self.players = players
+
+        self.smashes = {}
+        self.combines = {}
+        self.paints = {}
+
+        # Start off all counts at 0
+        for player in players:
+            self.smashes[player.id] = 0
+            self.combines[player.id] = 0
+            self.paints[player.id] = 0
+
+    def apply_move(self, player: Player,
+                   move: Tuple[str, Optional[int], Block]) -> bool:
+        """Attempt to do <player>'s <move> on the board, counting it towards
+        <player>'s penalties if it is a smash, paint or combine.
+
+        Return True iff the move was done.
+        """
+        action = (move[0], move[1])
+        direction = move[1]
+        block = move[2]
+        move_successful = False
+
+        if action in [ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE]:
+            move_successful = block.rotate(direction)
+        elif action in [SWAP_HORIZONTAL, SWAP_VERTICAL]:
+            move_successful = block.swap(direction)
+        elif action == SMASH:
+            move_successful = block.smash()
+            self.smashes[player.id] += int(move_successful)
+        elif action == PAINT:
+            move_successful = block.paint(player.goal.colour)
+            self.paints[player.id] += int(move_successful)
+        elif action == COMBINE:
+            move_successful = block.combine()
+            self.combines[player.id] += int(move_successful)
+        elif action == PASS:
+            # Do nothing
+            move_successful = True
+
+        return move_successful
+
+    def close(self) -> None:
+        """Release what the players hold for the game, such as worker
+        processes, once the game is over.
+        """
+        for player in self.players:
+            player.close()
+
+    def calculate_score(self, player_id: int) -> Tuple[int, int]:
+        """Return a tuple containing first the <player_id>'s score based on
+        their goal in the game and second the deductions from their score based
+        on the actions they've taken.
+        """
+        goal_score = self.players[player_id].goal.score(self.board)
+        return goal_score, self._penalty(player_id)
+
+    def calculate_scores(self) -> List[Tuple[int, int]]:
+        """Return a list containing, for every player in order, the tuple that
+        calculate_score returns for that player.
+
+        The goals of all of the players are scored together, so the board is
+        only scanned once.
+        """
+        goal_scores = score_all(self.board,
+                                [player.goal for player in self.players])
+        return [(goal_score, self._penalty(player.id))
+                for goal_score, player in zip(goal_scores, self.players)]
+
+    def _penalty(self, player_id: int) -> int:
+        """Return the deductions from <player_id>'s score based on the actions
+        they've taken.
+        """
+        return self.smashes[player_id] * ACTION_PENALTY[SMASH] + \
+            self.combines[player_id] * ACTION_PENALTY[COMBINE] + \
+            self.paints[player_id] * ACTION_PENALTY[PAINT]
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'random', 'typing', '__future__', 'block',
+            'goal', 'player', 'actions'
+        ]
+    })
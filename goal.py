@@ -22,11 +22,35 @@ Misha Schwartz, and Jaisie Sin
 This file contains the hierarchy of Goal classes.
 """
 from __future__ import annotations
-import math
+from collections import OrderedDict
 import random
-from typing import List, Tuple
-from block import Block
-from settings import colour_name, COLOUR_LIST
+import threading
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+import numpy as np
+from block import Block, undo_move
+from settings import colour_name, COLOUR_LIST, COLOUR_INDEX, NO_COLOUR_INDEX
+
+
+# Bit flags for the top, right, bottom and left edges of a Block
+_TOP, _RIGHT, _BOTTOM, _LEFT = 1, 2, 4, 8
+# The edges of its parent that each child touches, in the order of children
+_CHILD_EDGES = [_TOP | _RIGHT, _TOP | _LEFT, _BOTTOM | _LEFT, _BOTTOM | _RIGHT]
+# The number of edges in each combination of edge flags
+_EDGE_COUNT = [bin(edges).count('1') for edges in range(16)]
+# The most Blocks that a PerimeterGoal remembers the edge counts of
+_EDGE_COUNTS_LIMIT = 1 << 16
+# The most Blocks that an incremental BlobGoal remembers the summaries of
+_BLOB_SUMMARIES_LIMIT = 1 << 14
+# The pairs of (child, edge) that meet along the inner seams of a parent, where
+# edges are numbered 0 to 3 for the top, right, bottom and left edges
+_SEAMS = [((1, 1), (0, 3)), ((2, 1), (3, 3)), ((1, 2), (2, 0)),
+          ((0, 2), (3, 0))]
+
+# The connectivity of a Block for a single colour: the component label of each
+# unit cell along its top, right, bottom and left edges (-1 for cells of other
+# colours), the size of each labelled component, and the size of the largest
+# component that does not touch the edges of the Block.
+_BlobSummary = Tuple[Tuple[Tuple[int, ...], ...], List[int], int]
 
 
 def generate_goals(num_goals: int) -> List[Goal]:
@@ -49,39 +73,181 @@ def generate_goals(num_goals: int) -> List[Goal]:
     return out_list
 
 
-def _flatten(block: Block) -> List[List[Tuple[int, int, int]]]:
-    """Return a two-dimensional list representing <block> as rows and columns of
-    unit cells.
+def score_all(board: Block, goals: List[Goal]) -> List[int]:
+    """Return the score of each goal in <goals> on <board>, in the same order.
 
-    Return a list of lists L, where,
+    The board is flattened at most once for all of the goals: the perimeter
+    counts and the largest blobs of every colour are found in one sweep over
+    the flattened board. Scores already in SCORE_CACHE are reused, and the new
+    scores are added to it.
+    """
+    keys = [goal.cache_key(board) for goal in goals]
+    scores = [SCORE_CACHE.get(key) for key in keys]
+    if None not in scores:
+        return scores
+
+    grid = _flatten_grid(board)
+    perimeters = np.bincount(
+        np.concatenate([grid[:, 0], grid[:, -1], grid[0], grid[-1]]),
+        minlength=NO_COLOUR_INDEX + 1)
+    blobs = None
+    for i, goal in enumerate(goals):
+        if scores[i] is not None:
+            continue
+        index = COLOUR_INDEX.get(goal.colour, NO_COLOUR_INDEX)
+        if isinstance(goal, PerimeterGoal):
+            scores[i] = 0 if index == NO_COLOUR_INDEX \
+                else int(perimeters[index])
+        elif isinstance(goal, BlobGoal):
+            if blobs is None:
+                blobs = _largest_blobs(grid)
+            scores[i] = 0 if index == NO_COLOUR_INDEX else blobs.get(index, 0)
+        else:
+            scores[i] = goal.score(board)
+        SCORE_CACHE.put(keys[i], scores[i])
+    return scores
+
+
+def _leaf_regions(block: Block) -> Iterator[Tuple[int, int, int,
+                                                  Tuple[int, int, int]]]:
+    """Yield a tuple (x, y, length, colour) for every leaf of <block>.
+
+    <x> and <y> are the column and row, in unit cells, of the upper left corner
+    of the leaf relative to the upper left corner of <block>. <length> is the
+    side length of the leaf in unit cells, and <colour> is its colour.
+
+    Every Block in <block> is visited exactly once.
+    """
+    stack = [(block, 0, 0, 2 ** (block.max_depth - block.level))]
+    while stack:
+        b, x, y, length = stack.pop()
+        if b.colour is not None:
+            yield x, y, length, b.colour
+        else:
+            half = length // 2
+            stack.append((b.children[0], x + half, y, half))
+            stack.append((b.children[1], x, y, half))
+            stack.append((b.children[2], x, y + half, half))
+            stack.append((b.children[3], x + half, y + half, half))
+
+
+def _flatten_grid(block: Block) -> np.ndarray:
+    """Return a two-dimensional array of colour indices representing <block>
+    as columns and rows of unit cells.
+
+    Return an array G of dtype uint8, where,
     for 0 <= i, j < 2^{max_depth - self.level}
-        - L[i] represents column i and
-        - L[i][j] represents the unit cell at column i and row j.
+        - G[i] represents column i and
+        - G[i, j] represents the unit cell at column i and row j.
 
-    Each unit cell is represented by a tuple of 3 ints, which is the colour
-    of the block at the cell location[i][j]
+    Each unit cell holds the index in COLOUR_LIST of the colour of the block at
+    that cell location, or NO_COLOUR_INDEX if the colour is not in COLOUR_LIST.
 
-    L[0][0] represents the unit cell in the upper left corner of the Block.
+    G[0, 0] represents the unit cell in the upper left corner of the Block.
     """
-    # Reviewed 17/03/2020, although still kinda spaghetti code
-    out_list = []
-    if block.colour is not None:
-        length = int(math.pow(2, (block.max_depth - block.level)))
-        for i in range(length):
-            out_list.append([])
-            for _ in range(length):
-                out_list[i].append(block.colour)
-    else:
-        length = int(math.pow(2, (block.max_depth - block.level - 1)))
-        lh = []
-        rh = []
-        for i in range(length):
-            lh.append(_flatten(block.children[1])[i] +
-                      _flatten(block.children[2])[i])
-            rh.append(_flatten(block.children[0])[i] +
-                      _flatten(block.children[3])[i])
-        out_list.extend(lh + rh)
-    return out_list
+    length = 2 ** (block.max_depth - block.level)
+    grid = np.full((length, length), NO_COLOUR_INDEX, dtype=np.uint8)
+    for x, y, side, colour in _leaf_regions(block):
+        grid[x:x + side, y:y + side] = COLOUR_INDEX.get(colour,
+                                                        NO_COLOUR_INDEX)
+    return grid
+
+
+def _perimeter_count(block: Block, colour: Tuple[int, int, int]) -> int:
+    """Return the number of unit cells of <colour> on the perimeter of <block>.
+
+    Unit cells in the corners are on two edges, so they are counted twice.
+
+    Only the Blocks within <block> that touch its perimeter are visited.
+    """
+    count = 0
+    stack = [(block, _TOP | _RIGHT | _BOTTOM | _LEFT)]
+    while stack:
+        b, edges = stack.pop()
+        if b.colour is not None:
+            if b.colour == colour:
+                length = 2 ** (b.max_depth - b.level)
+                count += length * _EDGE_COUNT[edges]
+        else:
+            for child, child_edges in zip(b.children, _CHILD_EDGES):
+                if edges & child_edges:
+                    stack.append((child, edges & child_edges))
+    return count
+
+
+class ScoreCache:
+    """A cache of goal scores with a maximum size. When the cache is full, the
+    score that was least recently used is evicted to make room.
+
+    === Public Attributes ===
+    max_size:
+        The maximum number of scores in this cache.
+    hits:
+        The number of lookups that found a score in this cache.
+    misses:
+        The number of lookups that did not find a score in this cache.
+
+    === Representation Invariants ===
+    - max_size >= 0
+    """
+    # === Private Attributes ===
+    # _scores:
+    #   The cached scores, ordered from least to most recently used.
+    # _lock:
+    #   Held while _scores is used, so that threads can share this cache.
+    max_size: int
+    hits: int
+    misses: int
+    _scores: OrderedDict
+    _lock: threading.Lock
+
+    def __init__(self, max_size: int) -> None:
+        """Initialize this ScoreCache to hold at most <max_size> scores.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of scores in this cache.
+        """
+        return len(self._scores)
+
+    def get(self, key: Hashable) -> Optional[int]:
+        """Return the score cached for <key>, or None if there is none.
+        """
+        with self._lock:
+            score = self._scores.get(key)
+            if score is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._scores.move_to_end(key)
+            return score
+
+    def put(self, key: Hashable, score: int) -> None:
+        """Cache <score> for <key>, evicting the least recently used score if
+        this cache is full.
+        """
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all scores from this cache and reset its counters.
+        """
+        with self._lock:
+            self._scores.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# The cache of scores shared by every Goal
+SCORE_CACHE = ScoreCache(1 << 16)
 
 
 class Goal:
@@ -105,41 +271,350 @@ class Goal:
         """Return the current score for this goal on the given board.
 
         The score is always greater than or equal to 0.
+
+        Scores are cached in SCORE_CACHE by the board's canonical key, so a
+        board, or any rotation or reflection of it, is only scanned once.
+        """
+        key = self.cache_key(board)
+        score = SCORE_CACHE.get(key)
+        if score is None:
+            score = self._score(board)
+            SCORE_CACHE.put(key, score)
+        return score
+
+    def score_steps(self, board: Block) -> Iterator[Optional[int]]:
+        """Yield None after each part of the work of scoring the given board,
+        and finally yield its score, as score would return it.
+
+        By default the board is scored in one part, which is quick once its
+        hashes are up to date, unless the score is not cached.
+        """
+        yield self.score(board)
+
+    def cache_key(self, board: Block) -> Tuple[int, str, Tuple[int, int, int]]:
+        """Return the key of the score for this goal on the given board in
+        SCORE_CACHE.
+        """
+        return board.canonical_key(), type(self).__name__, self.colour
+
+    def _score(self, board: Block) -> int:
+        """Return the current score for this goal on the given board, without
+        using the cache.
         """
         raise NotImplementedError
 
+    def score_delta(self, board: Block, block: Block, action: str,
+                    direction: Optional[int] = None,
+                    colour: Optional[Tuple[int, int, int]] = None,
+                    rng: random.Random = random) -> Optional[int]:
+        """Return how much the score for this goal on <board> would change if
+        the action named <action> were performed on <block>, a Block within
+        <board>, or None if the action could not be performed.
+
+        <action>, <direction> and <rng> are as for Block.apply_move. <colour>
+        is the colour to paint with, which defaults to this goal's colour.
+        Smashing has a random outcome, so its change is that of one random
+        smash.
+
+        The action is performed and then undone, so <board> is not changed.
+        """
+        before = self.score(board)
+        if colour is None:
+            colour = self.colour
+        undo = block.apply_move(action, direction, colour, rng)
+        if undo is None:
+            return None
+        after = self.score(board)
+        undo_move(undo)
+        return after - before
+
+    def estimate_delta(self, board: Block, block: Block, action: str,
+                       direction: Optional[int] = None,
+                       colour: Optional[Tuple[int, int, int]] = None) -> int:
+        """Return a cheap estimate of score_delta for the action named
+        <action> on <block>, a Block within <board>, to order moves by before
+        they are scored.
+
+        The estimate is the change in the number of unit cells of this goal's
+        colour, so only painting and combining are estimated to change the
+        score. <board> is not changed.
+
+        Precondition: the action can be performed on <block>.
+        """
+        if action == 'paint':
+            if colour is None:
+                colour = self.colour
+            return (colour == self.colour) - (block.colour == self.colour)
+        elif action == 'combine':
+            matches = [child.colour for child in block.children].count(
+                self.colour)
+            # A Block that can be combined has a majority colour, which is this
+            # goal's colour if at least two of its children have it
+            return 4 - matches if matches >= 2 else -matches
+        return 0
+
+    def exact_estimate(self, action: str) -> bool:
+        """Return True iff estimate_delta always returns the same value as
+        score_delta for the action named <action>, so that a move estimated
+        with it does not need to be scored again.
+        """
+        return False
+
     def description(self) -> str:
         """Return a description of this goal.
         """
         raise NotImplementedError
 
 
-def _helper_score(flat: List[List]) -> List[List]:
-    """Return a 'visited' board in the format of a flattened board."""
-    # 01/04/2020
-    visited = []
-    for i in range(len(flat)):  # Make a visited board like _flatten()
-        visited.append([])
-        for _ in range(len(flat)):
-            visited[i].append(-1)
-    return visited
+def _find(parent: List[int], item: int) -> int:
+    """Return the representative of <item> in the union-find forest <parent>,
+    halving the path to it along the way.
+    """
+    while parent[item] != item:
+        parent[item] = parent[parent[item]]
+        item = parent[item]
+    return item
+
+
+def _blob_sizes(grid: np.ndarray, target: int) -> List[int]:
+    """Return the sizes of all the blobs of cells equal to <target> in <grid>,
+    where cells are connected vertically and horizontally.
+
+    <grid> is a flattened board, as returned by _flatten_grid. Each column is
+    split into runs of consecutive <target> cells, and runs in neighbouring
+    columns that share a row are joined with union-find, so the work depends on
+    the number of runs rather than on the number of cells.
+    """
+    padded = np.zeros((grid.shape[0], grid.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = grid == target
+    edges = np.diff(padded, axis=1)
+    columns, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1].tolist()
+    # Runs are ordered by column, so the runs of column i are
+    # bounds[i] <= r < bounds[i + 1]
+    bounds = np.searchsorted(columns, np.arange(grid.shape[0] + 1)).tolist()
+    starts = starts.tolist()
+
+    parent = list(range(len(starts)))
+    for i in range(grid.shape[0] - 1):
+        a, b = bounds[i], bounds[i + 1]
+        while a < bounds[i + 1] and b < bounds[i + 2]:
+            if starts[a] < ends[b] and starts[b] < ends[a]:
+                parent[_find(parent, a)] = _find(parent, b)
+            if ends[a] < ends[b]:
+                a += 1
+            else:
+                b += 1
+
+    sizes = {}
+    for run, start in enumerate(starts):
+        root = _find(parent, run)
+        sizes[root] = sizes.get(root, 0) + ends[run] - start
+    return list(sizes.values())
+
+
+def _largest_blobs(grid: np.ndarray) -> Dict[int, int]:
+    """Return a dictionary mapping each colour index in <grid> to the size of
+    the largest blob of cells of that colour index, where cells are connected
+    vertically and horizontally.
+
+    This labels the blobs of every colour in one sweep: each column is split
+    into runs of equal cells, and runs of the same colour index in neighbouring
+    columns that share a row are joined with union-find, as in _blob_sizes.
+    """
+    length = grid.shape[1]
+    changes = np.ones(grid.shape, dtype=bool)
+    changes[:, 1:] = grid[:, 1:] != grid[:, :-1]
+    columns, starts = np.nonzero(changes)
+    colours = grid[columns, starts].tolist()
+    starts = starts.tolist()
+    # Runs cover every column, so each run ends where the next one starts,
+    # unless it is the last run in its column
+    ends = [start or length for start in starts[1:]] + [length]
+    bounds = np.searchsorted(columns, np.arange(grid.shape[0] + 1)).tolist()
+
+    parent = list(range(len(starts)))
+    for i in range(grid.shape[0] - 1):
+        a, b = bounds[i], bounds[i + 1]
+        while a < bounds[i + 1] and b < bounds[i + 2]:
+            if colours[a] == colours[b]:
+                parent[_find(parent, a)] = _find(parent, b)
+            if ends[a] < ends[b]:
+                a += 1
+            elif ends[b] < ends[a]:
+                b += 1
+            else:
+                a += 1
+                b += 1
+
+    sizes = {}
+    for run, start in enumerate(starts):
+        root = _find(parent, run)
+        sizes[root] = sizes.get(root, 0) + ends[run] - start
+    largest = {}
+    for root, size in sizes.items():
+        largest[colours[root]] = max(largest.get(colours[root], 0), size)
+    return largest
+
+
+def _leaf_blob_summary(length: int, matches: bool) -> _BlobSummary:
+    """Return the blob summary of an undivided Block with side <length> in
+    unit cells, which is of the target colour if and only if <matches>.
+    """
+    if matches:
+        edge = (0,) * length
+        return (edge, edge, edge, edge), [length * length], 0
+    edge = (-1,) * length
+    return (edge, edge, edge, edge), [], 0
+
+
+def _merge_blob_summaries(children: List[_BlobSummary]) -> _BlobSummary:
+    """Return the blob summary of a Block whose four children have the blob
+    summaries <children>, in the usual order of children.
+
+    Components of neighbouring children are joined with union-find wherever
+    they meet along the inner seams, so the work depends on the side length of
+    the Block rather than on its area. Components that no longer reach the
+    edges of the Block are closed off and only their size is kept.
+    """
+    offsets = [0]
+    for child in children:
+        offsets.append(offsets[-1] + len(child[1]))
+    parent = list(range(offsets[-1]))
+    for (a, edge_a), (b, edge_b) in _SEAMS:
+        for x, y in zip(children[a][0][edge_a], children[b][0][edge_b]):
+            if x >= 0 and y >= 0:
+                parent[_find(parent, offsets[a] + x)] = \
+                    _find(parent, offsets[b] + y)
+
+    sizes = {}
+    for k, child in enumerate(children):
+        for label, size in enumerate(child[1]):
+            root = _find(parent, offsets[k] + label)
+            sizes[root] = sizes.get(root, 0) + size
+
+    labels = {}
+    edges = []
+    # The children along the top, right, bottom and left edges, in order
+    for (a, b), edge in zip([(1, 0), (0, 3), (2, 3), (1, 2)], range(4)):
+        cells = []
+        for k in (a, b):
+            for x in children[k][0][edge]:
+                if x < 0:
+                    cells.append(-1)
+                else:
+                    root = _find(parent, offsets[k] + x)
+                    cells.append(labels.setdefault(root, len(labels)))
+        edges.append(tuple(cells))
+
+    open_sizes = [0] * len(labels)
+    closed = max(child[2] for child in children)
+    for root, size in sizes.items():
+        if root in labels:
+            open_sizes[labels[root]] = size
+        else:
+            closed = max(closed, size)
+    return tuple(edges), open_sizes, closed
 
 
 class PerimeterGoal(Goal):
     """A player goal in the game of blocky, that calculates the score by the
     number of goal coloured blocks on the perimeter of the board.
     """
+    # === Private Attributes ===
+    # _edge_counts:
+    #   Maps the hash of a Block to the number of unit cells of this goal's
+    #   colour along its top, right, bottom and left edges, in that order.
+    _edge_counts: Dict[int, Tuple[int, int, int, int]]
+
+    def __init__(self, target_colour: Tuple[int, int, int]) -> None:
+        Goal.__init__(self, target_colour)
+        self._edge_counts = {}
+
+    def __getstate__(self) -> Dict:
+        """Return the state of this goal to pickle, without the remembered
+        edge counts, which can be recomputed.
+        """
+        state = self.__dict__.copy()
+        state['_edge_counts'] = {}
+        return state
+
     # Reviewed 17/03/2020
-    def score(self, board: Block) -> int:
-        flat = _flatten(board)
-        score = 0
-        for i in range(len(flat)):
-            for j in [0, len(flat) - 1]:
-                if flat[i][j] == self.colour:
-                    score += 1
-                if flat[j][i] == self.colour:
-                    score += 1
-        return score
+    def _score(self, board: Block) -> int:
+        return _perimeter_count(board, self.colour)
+
+    def _block_edge_counts(self, block: Block) -> Tuple[int, int, int, int]:
+        """Return the number of unit cells of this goal's colour along the top,
+        right, bottom and left edges of <block>, in that order.
+
+        Counts are remembered by the hash of each Block, so after a move only
+        the counts of the changed Block and its ancestors are recomputed.
+        """
+        key = hash(block)
+        counts = self._edge_counts.get(key)
+        if counts is None:
+            if block.colour is not None:
+                length = 2 ** (block.max_depth - block.level)
+                counts = (length,) * 4 if block.colour == self.colour \
+                    else (0, 0, 0, 0)
+            else:
+                ur, ul, ll, lr = [self._block_edge_counts(child)
+                                  for child in block.children]
+                counts = (ul[0] + ur[0], ur[1] + lr[1], ll[2] + lr[2],
+                          ul[3] + ll[3])
+            if len(self._edge_counts) >= _EDGE_COUNTS_LIMIT:
+                self._edge_counts.clear()
+            self._edge_counts[key] = counts
+        return counts
+
+    def score_delta(self, board: Block, block: Block, action: str,
+                    direction: Optional[int] = None,
+                    colour: Optional[Tuple[int, int, int]] = None,
+                    rng: random.Random = random) -> Optional[int]:
+        """Return how much the score for this goal on <board> would change if
+        the action named <action> were performed on <block>, a Block within
+        <board>, or None if the action could not be performed.
+
+        Only the edges of <block> that lie on the perimeter of <board> are
+        considered, so a move on a Block away from the perimeter is ranked
+        without touching the board at all.
+        """
+        path = board.path_to(block)
+        if action == 'smash' or path is None:
+            return Goal.score_delta(self, board, block, action, direction,
+                                    colour, rng)
+        edges = _TOP | _RIGHT | _BOTTOM | _LEFT
+        for i in path:
+            edges &= _CHILD_EDGES[i]
+        if colour is None:
+            colour = self.colour
+
+        before = self._block_edge_counts(block) if edges else None
+        undo = block.apply_move(action, direction, colour)
+        if undo is None:
+            return None
+        after = self._block_edge_counts(block) if edges else None
+        undo_move(undo)
+        return sum(after[i] - before[i] for i in range(4)
+                   if edges & (1 << i))
+
+    def estimate_delta(self, board: Block, block: Block, action: str,
+                       direction: Optional[int] = None,
+                       colour: Optional[Tuple[int, int, int]] = None) -> int:
+        """Return a cheap estimate of score_delta for the action named
+        <action> on <block>, a Block within <board>, to order moves by before
+        they are scored.
+
+        Every move but a smash is estimated exactly, since score_delta only
+        looks at the edges of <block> on the perimeter. A smash is estimated
+        not to change the score.
+        """
+        if action == 'smash':
+            return 0
+        return self.score_delta(board, block, action, direction, colour)
+
+    def exact_estimate(self, action: str) -> bool:
+        return action != 'smash'
 
     def description(self) -> str:
         # Reviewed 17/03/2020
@@ -150,55 +625,93 @@ class PerimeterGoal(Goal):
 class BlobGoal(Goal):
     """A player goal in the game of blocky, that calculates the score by the
     number of goal coloured blocks connected together vertically/horizontally.
+
+    === Public Attributes ===
+    incremental:
+        Whether scores are found from the remembered connectivity of each Block
+        rather than by labelling the whole board.
     """
-    def score(self, board: Block) -> int:
-        # Reviewed 17/03/2020
-        largest = 0  # There may be 0 blocks of this colour
-        flat = _flatten(board)
-        visited = _helper_score(flat)
-        for i in range(len(flat)):
-            for j in range(len(flat)):
-                current = self._undiscovered_blob_size((i, j), flat, visited)
-                if current > largest:
-                    largest = current
-        return largest
-
-    def _undiscovered_blob_size(self, pos: Tuple[int, int],
-                                board: List[List[Tuple[int, int, int]]],
-                                visited: List[List[int]]) -> int:
-        """Return the size of the largest connected blob that (a) is of this
-        Goal's target colour, (b) includes the cell at <pos>, and (c) involves
-        only cells that have never been visited.
-
-        If <pos> is out of bounds for <board>, return 0.
-
-        <board> is the flattened board on which to search for the blob.
-        <visited> is a parallel structure that, in each cell, contains:
-            -1 if this cell has never been visited
-            0  if this cell has been visited and discovered
-               not to be of the target colour
-            1  if this cell has been visited and discovered
-               to be of the target colour
-
-        Update <visited> so that all cells that are visited are marked with
-        either 0 or 1.
+    # === Private Attributes ===
+    # _summaries:
+    #   Maps the hash of a Block to its blob summary for this goal's colour.
+    incremental: bool
+    _summaries: Dict[int, _BlobSummary]
+
+    def __init__(self, target_colour: Tuple[int, int, int],
+                 incremental: bool = True) -> None:
+        Goal.__init__(self, target_colour)
+        self.incremental = incremental
+        self._summaries = {}
+
+    def __getstate__(self) -> Dict:
+        """Return the state of this goal to pickle, without the remembered
+        blob summaries, which can be recomputed.
         """
+        state = self.__dict__.copy()
+        state['_summaries'] = {}
+        return state
+
+    def _score(self, board: Block) -> int:
         # Reviewed 17/03/2020
-        i = pos[0]
-        j = pos[1]
-        size = 0
-        if i < len(board) and j < len(board) and visited[i][j] == -1:
-            if board[i][j] == self.colour:
-                visited[i][j] = 1
-                size += 1
-                for k in [-1, 1]:
-                    size += self._undiscovered_blob_size(
-                        (abs(i + k), j), board, visited) +\
-                        self._undiscovered_blob_size(
-                            (i, abs(j + k)), board, visited)
+        if self.incremental:
+            edges, sizes, closed = self._blob_summary(board)
+            return max(sizes + [closed])
+        return max(self.blob_sizes(board), default=0)
+
+    def score_steps(self, board: Block) -> Iterator[Optional[int]]:
+        """Yield None after each part of the work of scoring the given board,
+        and finally yield its score, as score would return it.
+
+        If this goal is incremental, each part finds the blob summary of one
+        Block whose summary is not remembered, after those of its children.
+        The score is looked up in SCORE_CACHE only once.
+        """
+        key = self.cache_key(board)
+        score = SCORE_CACHE.get(key)
+        if score is None:
+            stack = [(board, False)] if self.incremental else []
+            while stack:
+                block, children_done = stack.pop()
+                if hash(block) in self._summaries:
+                    continue
+                if children_done or block.colour is not None:
+                    self._blob_summary(block)
+                    yield None
+                else:
+                    stack.append((block, True))
+                    stack.extend((child, False) for child in block.children)
+            score = self._score(board)
+            SCORE_CACHE.put(key, score)
+        yield score
+
+    def _blob_summary(self, block: Block) -> _BlobSummary:
+        """Return the blob summary of <block> for this goal's colour.
+
+        Summaries are remembered by the hash of each Block, so after a move
+        only the changed Block and its ancestors are relabelled, and each
+        ancestor only along the seams between its children.
+        """
+        key = hash(block)
+        summary = self._summaries.get(key)
+        if summary is None:
+            if block.colour is not None:
+                summary = _leaf_blob_summary(
+                    2 ** (block.max_depth - block.level),
+                    block.colour == self.colour)
             else:
-                visited[i][j] = 0
-        return size
+                summary = _merge_blob_summaries(
+                    [self._blob_summary(child) for child in block.children])
+            if len(self._summaries) >= _BLOB_SUMMARIES_LIMIT:
+                self._summaries.clear()
+            self._summaries[key] = summary
+        return summary
+
+    def blob_sizes(self, board: Block) -> List[int]:
+        """Return the sizes of all the blobs of this Goal's target colour on
+        the given board, in no particular order.
+        """
+        target = COLOUR_INDEX.get(self.colour, NO_COLOUR_INDEX)
+        return _blob_sizes(_flatten_grid(board), target)
 
     def description(self) -> str:
         # Reviewed 17/03/2020
@@ -211,7 +724,7 @@ if __name__ == '__main__':
     python_ta.check_all(config={
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing', 'block', 'settings',
-            'math', '__future__'
+            'numpy', 'collections', 'threading', '__future__'
         ],
         'max-attributes': 15
     })
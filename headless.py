@@ -0,0 +1,129 @@
+"""CSC148 Assignment 2
+
+=== CSC148 Winter 2020 ===
+Department of Computer Science,
+University of Toronto
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+Authors: Diane Horton, David Liu, Mario Badr, Sophia Huynh, Misha Schwartz,
+and Jaisie Sin
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) Diane Horton, David Liu, Mario Badr, Sophia Huynh,
+Misha Schwartz, and Jaisie Sin
+
+=== Module Description ===
+
+This file contains the HeadlessGame class, which plays games of Blocky between
+computer players without a display, as fast as the players can move. Neither
+pygame nor a Renderer is needed, so many games can be played on a server, for
+example to balance players or to check for regressions.
+"""
+from __future__ import annotations
+from typing import List, Tuple
+
+from actions import PASS
+from block import Block, generate_board
+from gamedata import GameData
+from player import Player, create_players
+from settings import BOARD_SIZE
+
+
+class HeadlessGame:
+    """A game of Blocky between computer players, played without a display.
+
+    Every player moves as soon as it is its turn: there is no clock, no
+    rendering, no waiting for clicks and no animation.
+
+    === Public Attributes ===
+    data:
+        The data of the game.
+    turn:
+        The number of turns that every player has moved in so far.
+
+    === Representation Invariants ===
+    - turn >= 0
+    - No player in data.players is a HumanPlayer.
+    """
+    data: GameData
+    turn: int
+
+    def __init__(self, board: Block, players: List[Player]) -> None:
+        """Initialize this game, to be played by <players> on <board>.
+
+        Precondition:
+            - len(players) >= 1
+            - no player in <players> is a HumanPlayer
+        """
+        self.data = GameData(board, players)
+        self.turn = 0
+
+    def play_turn(self) -> None:
+        """Let every player make one move, in order.
+
+        A resumable player is asked for its move until it has chosen one. A
+        move that cannot be done is treated as a pass.
+        """
+        for player in self.data.players:
+            player.proceed()
+            move = player.generate_move(self.data.board)
+            while move is None:
+                move = player.generate_move(self.data.board)
+            if not self.data.apply_move(player, move):
+                self.data.apply_move(player, (PASS[0], PASS[1],
+                                              self.data.board))
+        self.turn += 1
+
+    def run_game(self, num_turns: int) -> List[Tuple[int, int, int]]:
+        """Play the rest of the game, until <num_turns> turns have been played,
+        and return a list of tuples containing each player ID, goal score and
+        penalty.
+
+        The players are closed once the game is over.
+        """
+        self.data.max_turns = num_turns
+        while self.turn < num_turns:
+            self.play_turn()
+        self.data.close()
+        return [(player.id, goal_score, penalty)
+                for player, (goal_score, penalty)
+                in zip(self.data.players, self.data.calculate_scores())]
+
+    def winner(self) -> int:
+        """Return the ID of the player with the highest score, less penalties,
+        choosing the first such player if there is a tie.
+        """
+        scores = [(player.id, goal_score - penalty)
+                  for player, (goal_score, penalty)
+                  in zip(self.data.players, self.data.calculate_scores())]
+        return max(scores, key=lambda item: item[1])[0]
+
+
+def create_headless_game(max_depth: int, num_random: int,
+                         smart_players: List[int]) -> HeadlessGame:
+    """Return a new HeadlessGame on a random board with a depth of <max_depth>,
+    played by <num_random> RandomPlayers and a SmartPlayer for each difficulty
+    in <smart_players>, as for create_players.
+
+    Precondition:
+        - num_random + len(smart_players) >= 1
+    """
+    board = generate_board(max_depth, BOARD_SIZE)
+    players = create_players(0, num_random, smart_players)
+    return HeadlessGame(board, players)
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'random', 'typing', '__future__', 'actions',
+            'block', 'gamedata', 'player', 'settings'
+        ]
+    })
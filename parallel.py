@@ -0,0 +1,247 @@
+"""CSC148 Assignment 2
+
+=== CSC148 Winter 2020 ===
+Department of Computer Science,
+University of Toronto
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+Authors: Diane Horton, David Liu, Mario Badr, Sophia Huynh, Misha Schwartz,
+and Jaisie Sin
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) Diane Horton, David Liu, Mario Badr, Sophia Huynh,
+Misha Schwartz, and Jaisie Sin
+
+=== Module Description ===
+
+This file contains the scoring of candidate moves for a SmartPlayer, either in
+this process or split across a persistent pool of worker processes.
+
+Boards are sent to the workers in a compact encoding, once for each worker
+every turn, and each candidate move names its Block by the path of child
+indices to it from the board. A smash is scored with a random number generator
+seeded from the turn's seed and the index of the candidate, so the same seed
+gives the same result whichever process scores it.
+
+Scoring stops early if the move is no longer wanted: the player's cancel event
+is checked between candidates in this process, and passed on to the workers
+through an event that they share with the pool.
+"""
+from __future__ import annotations
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+import random
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+from actions import ACTION_PENALTY
+from block import Block, EncodedBlock, decode_block
+from goal import Goal
+
+# A candidate move: its index among all the candidates for the turn, and the
+# move itself, as made by a Player.
+Candidate = Tuple[int, Tuple[str, Optional[int], Block]]
+
+# How often, in seconds, a MovePool checks whether its scoring was cancelled
+_CANCEL_POLL = 0.05
+
+# In a worker process, maps 'cancel' to the event that its MovePool sets to
+# cancel scoring. This is empty in any other process.
+_worker_state = {}
+
+
+def score_move(board: Block, goal: Goal, index: int,
+               move: Tuple[str, Optional[int], Block], seed: int,
+               score: int) -> int:
+    """Return the score of the candidate <move> at <index> for <goal>, on
+    <board>, whose score is <score>: the score of the board after the move,
+    less the move's penalty.
+
+    <board> is not mutated.
+    """
+    # Score the move by how much it changes the score of the board
+    delta = goal.score_delta(board, move[2], move[0], move[1],
+                             rng=random.Random(seed + index))
+    return score + delta - ACTION_PENALTY[(move[0], move[1])]
+
+
+def score_moves(board: Block, goal: Goal, candidates: List[Candidate],
+                seed: int, deadline: Optional[float] = None,
+                cancel: Optional[Any] = None) -> \
+        Tuple[Optional[int], int, int]:
+    """Return the index of the best of <candidates> for <goal> on <board>, its
+    score, and the number of candidates scored, in that order.
+
+    A candidate's score is the score of the board after the move, less the
+    move's penalty. The best candidate is the one with the highest score, and
+    the lowest index among those. If no candidate scores higher than <board>
+    itself, the index is None and the score is that of <board>.
+
+    Candidates are scored in increasing order of index until time.monotonic()
+    reaches <deadline>, if it is not None, or <cancel>, an event of the
+    threading or multiprocessing module, is set. At least one candidate is
+    scored, however early <deadline> is, unless <cancel> is set. <board> is
+    not mutated.
+    """
+    best_index = None
+    best = score = goal.score(board)
+    scored = 0
+    for index, move in candidates:
+        if scored > 0 and deadline is not None and \
+                time.monotonic() >= deadline:
+            break
+        if cancel is not None and cancel.is_set():
+            break
+        current = score_move(board, goal, index, move, seed, score)
+        if current > best:
+            best_index, best = index, current
+        scored += 1
+    return best_index, best, scored
+
+
+def _score_encoded_moves(encoded: EncodedBlock, goal: Goal,
+                         candidates: List[Tuple[int, List[int], str,
+                                                Optional[int]]],
+                         seed: int, deadline: Optional[float]) -> \
+        Tuple[Optional[int], int, int]:
+    """Return the result of score_moves for the board encoded as <encoded>,
+    where each of <candidates> names its Block by the path to it.
+
+    This runs in the worker processes of a MovePool, and stops early if the
+    pool cancels it.
+    """
+    board = decode_block(encoded)
+    moves = []
+    for index, path, action, direction in candidates:
+        block = board
+        for i in path:
+            block = block.children[i]
+        moves.append((index, (action, direction, block)))
+    return score_moves(board, goal, moves, seed, deadline,
+                       _worker_state.get('cancel'))
+
+
+def _start_worker(cancel: Any) -> None:
+    """Remember <cancel>, the event that the MovePool of this worker process
+    sets to cancel scoring.
+    """
+    _worker_state['cancel'] = cancel
+
+
+class MovePool:
+    """A persistent pool of worker processes that score candidate moves in
+    parallel.
+
+    === Public Attributes ===
+    workers:
+        The number of worker processes.
+
+    === Representation Invariants ===
+    - workers >= 1
+    """
+    # === Private Attributes ===
+    # _executor:
+    #   The pool of worker processes, or None if it has not been started.
+    # _cancel:
+    #   The event, shared with the worker processes, that is set while the
+    #   scoring they are doing is cancelled, or None if they have never been
+    #   started.
+    workers: int
+    _executor: Optional[ProcessPoolExecutor]
+    _cancel: Optional[Any]
+
+    def __init__(self, workers: int) -> None:
+        """Initialize this pool with <workers> worker processes, which are
+        started when they are first needed.
+        """
+        self.workers = workers
+        self._executor = None
+        self._cancel = None
+
+    def score_moves(self, board: Block, goal: Goal,
+                    candidates: List[Candidate], seed: int,
+                    deadline: Optional[float] = None,
+                    cancel: Optional[threading.Event] = None) -> \
+            Tuple[Optional[int], int, int]:
+        """Return the same result as the function score_moves, by splitting
+        <candidates> across the worker processes of this pool.
+
+        If <cancel> is set, the workers stop after the candidate that each is
+        scoring, and only the candidates scored so far count.
+        """
+        if self._executor is None:
+            # The pool is started from whichever thread first scores moves,
+            # so its workers are spawned rather than forked from a process
+            # that may have other threads running
+            context = multiprocessing.get_context('spawn')
+            self._cancel = context.Event()
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=context, initializer=_start_worker,
+                initargs=(self._cancel,))
+        encoded = board.encode()
+        named = [(index, board.path_to(move[2]), move[0], move[1])
+                 for index, move in candidates]
+        futures = [self._executor.submit(_score_encoded_moves, encoded, goal,
+                                         named[i::self.workers], seed,
+                                         deadline)
+                   for i in range(min(self.workers, len(named)))]
+        if cancel is not None:
+            self._wait(futures, cancel)
+
+        best_index = None
+        best = goal.score(board)
+        scored = 0
+        for future in futures:
+            if future.cancelled():
+                continue
+            index, score, count = future.result()
+            if index is not None and (
+                    score > best or (score == best and index < best_index)):
+                best_index, best = index, score
+            scored += count
+        return best_index, best, scored
+
+    def _wait(self, futures: List[Any], cancel: threading.Event) -> None:
+        """Wait until all of <futures> are done, and if <cancel> is set
+        first, make the worker processes stop scoring them.
+        """
+        pending = set(futures)
+        while pending and not cancel.is_set():
+            pending = wait(pending, _CANCEL_POLL, FIRST_COMPLETED).not_done
+        if pending:
+            self._cancel.set()
+            for future in pending:
+                future.cancel()
+            # The workers stop after at most one more candidate each, and the
+            # event is cleared for the next turn only once they have
+            wait(pending)
+            self._cancel.clear()
+
+    def close(self) -> None:
+        """Stop the worker processes of this pool.
+        """
+        if self._executor is not None:
+            # Stop any scoring in progress, so that shutting down does not
+            # wait for it
+            self._cancel.set()
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'doctest', 'python_ta', 'random', 'typing', 'actions', 'block',
+            'goal', 'concurrent.futures', 'time', '__future__',
+            'multiprocessing', 'threading'
+        ],
+        'max-args': 7
+    })
@@ -22,15 +22,28 @@ Misha Schwartz, and Jaisie Sin.
 This file contains the hierarchy of player classes.
 """
 from __future__ import annotations
-from typing import List, Optional, Tuple
+from typing import Dict, Generator, Iterable, Iterator, List, Optional, \
+    Tuple
+import itertools
+import math
 import random
-import pygame
-
-from block import Block
-from goal import Goal, generate_goals
+import threading
+import time
+try:
+    import pygame
+except ImportError:
+    # pygame is only needed to handle the input of players
+    pygame = None
+
+from block import Block, Undo, undo_move
+from goal import Goal, ScoreCache, generate_goals
+from parallel import MovePool, score_move
 
 from actions import KEY_ACTION, ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE, \
-    SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PASS, PAINT, COMBINE
+    SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PASS, PAINT, COMBINE, ACTION_PENALTY
+
+# The most boards that a SearchPlayer remembers the values of
+_TABLE_SIZE = 1 << 16
 
 
 def create_players(num_human: int, num_random: int, smart_players: List[int]) \
@@ -64,6 +77,31 @@ def create_players(num_human: int, num_random: int, smart_players: List[int]) \
     return players
 
 
+def legal_moves(board: Block, colour: Tuple[int, int, int],
+                level: Optional[int] = None) -> \
+        Iterator[Tuple[str, Optional[int], Block]]:
+    """Yield every move, other than PASS, that can be successfully performed
+    on <board> or any Block within it, painting with <colour>.
+
+    If <level> is not None, only yield the moves on Blocks at <level>.
+
+    Each move is a tuple as returned by Player.generate_move. Moves are
+    yielded lazily, one Block at a time, and nothing is mutated: legality is
+    read from the legal actions that each Block keeps up to date.
+    """
+    stack = [board]
+    while stack:
+        block = stack.pop()
+        if level is None or block.level == level:
+            for action in [ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE,
+                           SWAP_HORIZONTAL, SWAP_VERTICAL, SMASH, PAINT,
+                           COMBINE]:
+                if block.is_legal(action[0], colour):
+                    yield _create_move(action, block)
+        if level is None or block.level < level:
+            stack.extend(reversed(block.children))
+
+
 def _get_block(block: Block, location: Tuple[int, int], level: int) -> \
         Optional[Block]:
     """Return the Block within <block> that is at <level> and includes
@@ -126,7 +164,32 @@ class Player:
         """
         raise NotImplementedError
 
-    def generate_move(self, board: Block) -> \
+    def is_ready(self) -> bool:
+        """Return True iff generate_move would try to make a move now, rather
+        than return None while this player waits for input.
+        """
+        return True
+
+    def proceed(self) -> None:
+        """Let this player make its next move without waiting for input, as a
+        click of the mouse does for a computer player.
+        """
+        return
+
+    def is_resumable(self) -> bool:
+        """Return True iff this player chooses its moves a little at a time,
+        over several calls to generate_move, each of which returns quickly.
+        """
+        return False
+
+    def close(self) -> None:
+        """Release what this player holds for the game, such as worker
+        processes, once the game is over.
+        """
+        return
+
+    def generate_move(self, board: Block,
+                      cancel: Optional[threading.Event] = None) -> \
             Optional[Tuple[str, Optional[int], Block]]:
         """Return a potential move to make on the game board.
 
@@ -135,37 +198,28 @@ class Player:
         or smash). The integer indicates the direction (i.e., for rotate and
         swap). And the block indicates which block is being acted on.
 
-        Return None if no move can be made, yet.
+        Return None if no move can be made, yet. A resumable player may also
+        return None after doing part of the work of choosing a move, and
+        continue from there on the next call with the same board.
+
+        <cancel> is set by another thread if the move is no longer wanted. A
+        player that takes long to choose its move then stops as soon as it
+        can, and returns the best move it has so far, or PASS.
         """
         raise NotImplementedError
 
-    def _helper_generate_move_check(self, action: Tuple[str, Optional[int]],
-                                    block: Block) -> bool:
-        # Reviewed 17/03/2020
-        """Return whether or not an action can be successfully performed on
-        the given block.
 
-        This mutates the block, and should be used on a shallow copy of block.
-        """
-        # Reviewed 17/03/2020
-        success = False
-        if action == ROTATE_CLOCKWISE:
-            success = block.rotate(1)
-        elif action == ROTATE_COUNTER_CLOCKWISE:
-            success = block.rotate(3)
-        elif action == SWAP_HORIZONTAL:
-            success = block.swap(0)
-        elif action == SWAP_VERTICAL:
-            success = block.swap(1)
-        elif action == PAINT:
-            success = block.paint(self.goal.colour)
-        elif action == COMBINE:
-            success = block.combine()
-        elif action == SMASH:
-            success = block.smash()
-        elif action == PASS:
-            success = True
-        return success
+def _past(deadline: Optional[float]) -> bool:
+    """Return True iff <deadline>, a time as returned by time.monotonic(), is
+    not None and has passed.
+    """
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _cancelled(cancel: Optional[threading.Event]) -> bool:
+    """Return True iff <cancel> is not None and has been set.
+    """
+    return cancel is not None and cancel.is_set()
 
 
 def _create_move(action: Tuple[str, Optional[int]], block: Block) -> \
@@ -173,34 +227,32 @@ def _create_move(action: Tuple[str, Optional[int]], block: Block) -> \
     return action[0], action[1], block
 
 
-def _helper_generate_move_level(board: Block,
-                                copy: Block) -> Tuple[Block, Block]:
-    """Iterates to a random valid level of both block and copy to the
-    same level.
-
-    This does not mutate any values of block or copy.
+def _random_move(board: Block, colour: Tuple[int, int, int],
+                 rng: random.Random = random) -> \
+        Tuple[str, Optional[int], Block]:
+    """Return a random move that can be performed on <board>, painting with
+    <colour>, chosen as a RandomPlayer chooses its moves, using <rng>.
+
+    Each move has the chance it would have if a random level was picked, then
+    a Block by descending to random children until that level or a Block with
+    no children, and then one of the 8 actions, with rotate and swap once for
+    each direction, all uniformly, picking again until the move could be
+    performed. The action and then the Block are instead picked in proportion
+    to the descent weights of the Blocks that each action can be performed on,
+    so nothing is copied or retried, and <board> is not mutated.
     """
-    # Reviewed 17/03/2020. Strange bug where return at comment causes crash
-    level = random.randint(0, board.max_depth)
-    while level > board.level:
-        if board.colour is None:
-            i = random.randint(0, 3)
-            board = board.children[i]
-            copy = copy.children[i]
-        else:
-            break  # return board, copy here causes game to crash
-    return board, copy
-
-
-def _helper_generate_move_choose() -> tuple:
-    """Return a random possible action."""
-    # Reviewed 17/03/2020
-    actions_and_penalties = [(ROTATE_CLOCKWISE, 0),
-                             (ROTATE_COUNTER_CLOCKWISE, 0),
-                             (SWAP_HORIZONTAL, 0), (SWAP_VERTICAL, 0),
-                             (SMASH, 3), (PAINT, 1),
-                             (COMBINE, 1), (PASS, 0)]
-    return random.choice(actions_and_penalties)
+    actions = [ROTATE_CLOCKWISE, ROTATE_COUNTER_CLOCKWISE, SWAP_HORIZONTAL,
+               SWAP_VERTICAL, SMASH, PAINT, COMBINE]
+    weights = [board.legal_block_weight(action[0], colour)
+               for action in actions]
+    # PASS can be performed on every Block, whose weights sum to this
+    levels = board.max_depth - board.level + 1
+    weights.append(4 ** (levels - 1) * levels)
+    action = rng.choices(actions + [PASS], weights)[0]
+    if action == PASS:
+        return _create_move(PASS, board)
+    return _create_move(action, board.random_legal_block(action[0], colour,
+                                                         rng, True))
 
 
 class HumanPlayer(Player):
@@ -254,7 +306,8 @@ class HumanPlayer(Player):
                 self._level += 1
                 self._desired_action = None
 
-    def generate_move(self, board: Block) -> \
+    def generate_move(self, board: Block,
+                      cancel: Optional[threading.Event] = None) -> \
             Optional[Tuple[str, Optional[int], Block]]:
         """Return the move that the player would like to perform. The move may
         not be valid.
@@ -272,8 +325,12 @@ class HumanPlayer(Player):
             return move
 
 
-class RandomPlayer(Player):
-    """A player in the game of blocky that makes random moves each turn"""
+class ComputerPlayer(Player):
+    """A player in the Blocky game that chooses its own moves, making each one
+    after a click of the mouse.
+
+    This is an abstract class. Only child classes should be instantiated.
+    """
     # === Private Attributes ===
     # _proceed:
     #   True when the player should make a move, False when the player should
@@ -281,7 +338,8 @@ class RandomPlayer(Player):
     _proceed: bool
 
     def __init__(self, player_id: int, goal: Goal) -> None:
-        # Reviewed 17/03/2020
+        """Initialize this ComputerPlayer, waiting to make its first move.
+        """
         Player.__init__(self, player_id, goal)
         self._proceed = False
 
@@ -292,7 +350,31 @@ class RandomPlayer(Player):
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
             self._proceed = True
 
-    def generate_move(self, board: Block) ->\
+    def is_ready(self) -> bool:
+        return self._proceed
+
+    def proceed(self) -> None:
+        self._proceed = True
+
+
+class RandomPlayer(ComputerPlayer):
+    """A player in the game of blocky that makes random moves each turn"""
+    # === Private Attributes ===
+    # _rng:
+    #   The source of randomness for choosing moves.
+    _rng: random.Random
+
+    def __init__(self, player_id: int, goal: Goal,
+                 seed: Optional[int] = None) -> None:
+        """Initialize this RandomPlayer. Players with the same <seed> make the
+        same moves on the same boards.
+        """
+        # Reviewed 17/03/2020
+        ComputerPlayer.__init__(self, player_id, goal)
+        self._rng = random.Random(seed)
+
+    def generate_move(self, board: Block,
+                      cancel: Optional[threading.Event] = None) ->\
             Optional[Tuple[str, Optional[int], Block]]:
         """Return a valid, randomly generated move.
 
@@ -302,49 +384,80 @@ class RandomPlayer(Player):
         This function does not mutate <board>.
         """
         # Reviewed 17/03/2020
-        action = PASS  # Default, but are always overridden
-        board_child = board
         if not self._proceed:
             return None  # Do not remove
-        success = False  # Initialize success value as False
-        while not success:  # While a valid move has not been generated
-            copy = board.create_copy()
-            board_and_copy = _helper_generate_move_level(board, copy)
-            board_child = board_and_copy[0]
-            copy_child = board_and_copy[1]
-            action = _helper_generate_move_choose()[0]
-            success = self._helper_generate_move_check(action, copy_child)
         self._proceed = False  # Must set to False before returning!
-        return _create_move(action, board_child)  # Create the move
+        return _random_move(board, self.goal.colour, self._rng)
 
 
-class SmartPlayer(Player):
+class SmartPlayer(ComputerPlayer):
     """A player in the game of blocky that considers a given amount of possible
     moves and choosing the best move.
+
+    === Public Attributes ===
+    moves_scored:
+        The number of distinct moves scored the last time this player
+        generated a move.
     """
     # === Private Attributes ===
-    # _proceed:
-    #   True when the player should make a move, False when the player should
-    #   wait.
     # _difficulty:
     #   The number of possible moves considered
+    # _time_budget:
+    #   The most time, in milliseconds, that scoring moves may take each turn,
+    #   or None if there is no limit.
+    # _rng:
+    #   The source of randomness for choosing and scoring moves.
+    # _pool:
+    #   The pool of worker processes that scores moves, or None if moves are
+    #   scored in this process.
+    # _frame_budget:
+    #   The most time, in milliseconds, that each call to generate_move may
+    #   spend scoring moves, or None if a move is chosen in a single call.
+    # _thinking:
+    #   The generator that is choosing this player's move, if it has not
+    #   finished, or None.
+    moves_scored: int
     _difficulty: int
-    _proceed: bool
-
-    def __init__(self, player_id: int, goal: Goal, difficulty: int) -> None:
+    _time_budget: Optional[float]
+    _rng: random.Random
+    _pool: Optional[MovePool]
+    _frame_budget: Optional[float]
+    _thinking: Optional[Iterator[Optional[Tuple[str, Optional[int], Block]]]]
+
+    def __init__(self, player_id: int, goal: Goal, difficulty: int,
+                 time_budget: Optional[float] = None, workers: int = 0,
+                 seed: Optional[int] = None,
+                 frame_budget: Optional[float] = None) -> None:
+        """Initialize this SmartPlayer.
+
+        If <workers> is positive, moves are scored by a pool of that many
+        worker processes, which is kept for the whole game. Players with the
+        same <seed> choose the same moves, whether or not they use workers.
+
+        If <frame_budget> is not None, this player is resumable: each call to
+        generate_move stops choosing a move, in this process, once that many
+        milliseconds have passed, and the work so far, including the best move
+        so far, is kept between calls.
+        """
         # 16/03/2020
-        Player.__init__(self, player_id, goal)
+        ComputerPlayer.__init__(self, player_id, goal)
         self._difficulty = difficulty
-        self._proceed = False
-
-    def get_selected_block(self, board: Block) -> Optional[Block]:
-        return None
-
-    def process_event(self, event: pygame.event.Event) -> None:
-        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            self._proceed = True
-
-    def generate_move(self, board: Block) ->\
+        self._time_budget = time_budget
+        self._rng = random.Random(seed)
+        self._pool = MovePool(workers) if workers > 0 else None
+        self._frame_budget = frame_budget
+        self._thinking = None
+        self.moves_scored = 0
+
+    def is_resumable(self) -> bool:
+        return self._frame_budget is not None
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+
+    def generate_move(self, board: Block,
+                      cancel: Optional[threading.Event] = None) ->\
             Optional[Tuple[str, Optional[int], Block]]:
         """Return a valid move by assessing multiple valid moves and choosing
         the move that results in the highest score for this player's goal (i.e.,
@@ -354,39 +467,740 @@ class SmartPlayer(Player):
         performed on the <board>. If no move can be found that is better than
         the current score, this player will pass.
 
+        Up to difficulty distinct valid moves are scored, chosen at random. If
+        the difficulty is at least the number of valid moves, every valid move
+        is scored.
+
+        If this player has a time budget, scoring stops once it runs out and the
+        best move found so far is returned, or PASS if none was. The budget
+        starts once the board itself has been scored, and at least one move
+        is scored however small it is. Moves are then scored from the most to
+        the least promising, by the goal's estimate of each, less its penalty;
+        estimating takes at most half of the budget, so that there is time left
+        to score the best estimates.
+
+        If this player is resumable, None is returned until every move has
+        been scored, or the time budget has run out, over as many calls as
+        that takes. Each call makes some progress, however small the frame
+        budget. <board> must not change between those calls.
+
+        If <cancel> is set, scoring stops as it does when the time budget runs
+        out, including in the worker processes.
+
+        This function does not mutate <board>.
+        """
+        # Reviewed 17/03/2020
+        if self._thinking is None:
+            if not self._proceed:
+                return None  # Do not remove
+            self._thinking = self._think(board, cancel)
+        move = next(self._thinking)
+        if move is not None:
+            self._thinking = None
+            self._proceed = False
+        return move
+
+    def _think(self, board: Block, cancel: Optional[threading.Event]) -> \
+            Iterator[Optional[Tuple[str, Optional[int], Block]]]:
+        """Choose a move for <board> as described for generate_move, yielding
+        None each time the frame budget runs out and finally yielding the move.
+
+        At least one part of the work is done in each frame, as described for
+        _choose_move, so a move is always chosen eventually.
+        """
+        steps = self._choose_move(board, cancel)
+        while True:
+            frame_deadline = None if self._frame_budget is None else \
+                time.monotonic() + self._frame_budget / 1000
+            for move in steps:
+                if move is not None:
+                    yield move
+                    return
+                if _past(frame_deadline):
+                    break
+            yield None
+
+    def _choose_move(self, board: Block,
+                     cancel: Optional[threading.Event]) -> \
+            Iterator[Optional[Tuple[str, Optional[int], Block]]]:
+        """Choose a move for <board> as described for generate_move, yielding
+        None after each part of the work, and finally yielding the move.
+
+        Each part brings one Block of the board up to date, or estimates or
+        scores one move. Moves are scored by a pool of worker processes, in a
+        single part, if this player has one and is not resumable. Work stops
+        after the part in progress once <cancel> is set.
+        """
+        self.moves_scored = 0
+        # The board's hashes, legal moves and score are brought up to date a
+        # part at a time, so that a large board can not overrun a frame. This
+        # is not part of the time budget, which is only for the moves.
+        score = 0
+        for score in itertools.chain(board.update_caches(),
+                                     self.goal.score_steps(board)):
+            if _cancelled(cancel):
+                yield _create_move(PASS, board)
+                return
+            yield None
+        deadline = None if self._time_budget is None else \
+            time.monotonic() + self._time_budget / 1000
+
+        # Candidates are sampled by their index among the legal moves, and
+        # only found when they are needed
+        colour = self.goal.colour
+        total = board.legal_move_count(colour)
+        indices = range(total) if self._difficulty >= total else \
+            self._rng.sample(range(total), self._difficulty)
+        seed = self._rng.getrandbits(32)
+        # Maps the index of each move whose estimate is exact to its score
+        known = {}
+        if deadline is None:
+            moves = (board.legal_move(colour, i) for i in indices)
+        else:
+            moves, deltas = yield from self._rank_moves(board, indices,
+                                                        deadline, cancel)
+            known = {index: score + delta for index, delta in deltas.items()}
+        if self._pool is not None and self._frame_budget is None:
+            moves = list(moves)
+            best, best_score, self.moves_scored = self._pool.score_moves(
+                board, self.goal, [(index, move) for index, move
+                                   in enumerate(moves) if index not in known],
+                seed, deadline, cancel)
+            # Ties go to the earliest move, as when moves are scored in turn
+            for index in sorted(known):
+                if known[index] > best_score or (
+                        known[index] == best_score and best is not None and
+                        index < best):
+                    best, best_score = index, known[index]
+            self.moves_scored += len(known)
+            yield _create_move(PASS, board) if best is None else moves[best]
+            return
+
+        best_move = None
+        best = score
+        for index, move in enumerate(moves):
+            # At least one move is scored, however small the time budget
+            if (self.moves_scored > 0 and _past(deadline)) or \
+                    _cancelled(cancel):
+                break
+            if index in known:
+                current = known[index]
+            else:
+                current = score_move(board, self.goal, index, move, seed,
+                                     score)
+            if current > best:
+                best_move, best = move, current
+            self.moves_scored += 1
+            yield None
+        yield _create_move(PASS, board) if best_move is None else best_move
+
+    def _rank_moves(self, board: Block, indices: Iterable[int],
+                    deadline: float, cancel: Optional[threading.Event]) -> \
+            Generator[None, None,
+                      Tuple[List[Tuple[str, Optional[int], Block]],
+                            Dict[int, int]]]:
+        """Return the legal moves on <board> at <indices>, as for
+        Block.legal_move, from the highest to the lowest estimate of their
+        score, less their penalty, yielding None after each is estimated.
+
+        Also return a dictionary that maps the index, in the returned list, of
+        each move whose estimate is exact to its estimate, so that the move
+        does not need to be scored again.
+
+        Moves are estimated until half of the time left before <deadline> has
+        passed, or <cancel> is set, and only those estimated are returned.
+        """
+        now = time.monotonic()
+        stop = now + (deadline - now) / 2
+        estimates = []
+        for i in indices:
+            move = board.legal_move(self.goal.colour, i)
+            estimate = self.goal.estimate_delta(board, move[2], move[0],
+                                                move[1]) - \
+                ACTION_PENALTY[(move[0], move[1])]
+            estimates.append((estimate, move))
+            if time.monotonic() >= stop or _cancelled(cancel):
+                break
+            yield None
+        # The sort is stable, so moves with the same estimate stay in the
+        # random order that they were sampled in
+        estimates.sort(key=lambda item: -item[0])
+        exact = {index: estimate
+                 for index, (estimate, move) in enumerate(estimates)
+                 if self.goal.exact_estimate(move[0])}
+        return [move for _, move in estimates], exact
+
+
+class _SearchTimeout(Exception):
+    """Raised when a SearchPlayer runs out of time in the middle of a search.
+    """
+
+
+class SearchPlayer(ComputerPlayer):
+    """A player in the game of blocky that looks several turns ahead, and
+    chooses the move that leads to the best score for its goal, less penalties,
+    after the replies of the other players.
+
+    The other players are either assumed to reply with the moves that hurt this
+    player the most (minimax), or with any one of the moves that help their own
+    goals the most, each as likely as the others (expectimax).
+
+    === Public Attributes ===
+    nodes_searched:
+        The number of boards searched the last time this player generated a
+        move.
+    depth_reached:
+        The number of turns ahead that the last completed search looked.
+    """
+    # === Private Attributes ===
+    # _depth:
+    #   The most turns ahead to search, including this player's own turn.
+    # _width:
+    #   The most moves searched from each board, after they are ordered by how
+    #   much they change the score in one turn.
+    # _time_budget:
+    #   The most time, in milliseconds, that a search may take each turn, or
+    #   None if there is no limit.
+    # _opponents:
+    #   The goals of the other players, in the order that they play after this
+    #   player.
+    # _expectimax:
+    #   True if the other players are modelled by expectimax rather than
+    #   minimax.
+    # _rng:
+    #   The source of randomness for smashing Blocks during the search.
+    # _table:
+    #   The transposition table. Maps the hash of a board, the number of turns
+    #   left to search and whose turn it is to the value of that board and
+    #   whether that value is exact (0), a lower bound (1) or an upper bound
+    #   (-1). Its size is bounded, so old values are forgotten. The hash is not
+    #   the canonical key, since the moves searched from a board depend on its
+    #   orientation.
+    # _deadline:
+    #   The value of time.monotonic() at which the current search must stop,
+    #   or None if it has no time limit.
+    # _cancel:
+    #   The event that is set if the current search is no longer wanted, or
+    #   None.
+    nodes_searched: int
+    depth_reached: int
+    _depth: int
+    _width: int
+    _time_budget: Optional[float]
+    _opponents: List[Goal]
+    _expectimax: bool
+    _rng: random.Random
+    _table: ScoreCache
+    _deadline: Optional[float]
+    _cancel: Optional[threading.Event]
+
+    def __init__(self, player_id: int, goal: Goal, depth: int, width: int = 8,
+                 time_budget: Optional[float] = None,
+                 opponents: Optional[List[Goal]] = None,
+                 expectimax: bool = False, seed: Optional[int] = None) -> None:
+        """Initialize this SearchPlayer.
+
+        The search looks up to <depth> turns ahead, considering the <width>
+        most promising moves from each board, and stops early if it takes more
+        than <time_budget> milliseconds. <opponents> are the goals of the
+        other players, in the order that they play after this player.
+
+        Precondition:
+            - depth >= 1
+            - width >= 1
+        """
+        ComputerPlayer.__init__(self, player_id, goal)
+        self._depth = depth
+        self._width = width
+        self._time_budget = time_budget
+        self._opponents = [] if opponents is None else opponents
+        self._expectimax = expectimax
+        self._rng = random.Random(seed)
+        self._table = ScoreCache(_TABLE_SIZE)
+        self._deadline = None
+        self._cancel = None
+        self.nodes_searched = 0
+        self.depth_reached = 0
+
+    def generate_move(self, board: Block,
+                      cancel: Optional[threading.Event] = None) ->\
+            Optional[Tuple[str, Optional[int], Block]]:
+        """Return the move that leads to the best score for this player's
+        goal, less penalties, as found by searching ahead.
+
+        The search deepens one turn at a time, searching the best move of the
+        last depth first. If it runs out of time, or <cancel> is set, the best
+        move of the deepest completed search is returned; if not even one turn
+        ahead was completed, the move that changes the score the most in one
+        turn is, or PASS if <cancel> was set before that move was found.
+
+        The time budget starts once the board itself has been scored. If there
+        are too many moves to order in half of it, only those tried in that
+        time are searched.
+
+        This function does not mutate <board>.
+        """
+        if not self._proceed:
+            return None  # Do not remove
+        self.nodes_searched = 0
+        self.depth_reached = 0
+        # As for a SmartPlayer, the time budget starts once the board itself
+        # has been scored
+        self.goal.score(board)
+        self._deadline = None if self._time_budget is None else \
+            time.monotonic() + self._time_budget / 1000
+        self._cancel = cancel
+        best = _create_move(PASS, board)
+        # As for a SmartPlayer, ordering the moves at the root takes at most
+        # half of the time budget, so that there is time left to search them
+        stop = None if self._deadline is None else \
+            time.monotonic() + self._time_budget / 2000
+        try:
+            moves = self._ordered_moves(board, 0, stop)
+            best = moves[0]
+            for depth in range(1, self._depth + 1):
+                best = self._search_root(board, moves, depth)
+                self.depth_reached = depth
+                moves.sort(key=lambda m: m is not best)
+        except _SearchTimeout:
+            pass
+        self._proceed = False
+        return best
+
+    def _turn_goal(self, turn: int) -> Goal:
+        """Return the goal of the player whose turn it is, where <turn> is 0
+        for this player and i for the i-th of its opponents.
+        """
+        return self.goal if turn == 0 else self._opponents[turn - 1]
+
+    def _ordered_moves(self, board: Block, turn: int,
+                       stop: Optional[float] = None) -> \
+            List[Tuple[str, Optional[int], Block]]:
+        """Return the most promising moves, including PASS, for the player
+        whose turn it is on <board>, from the most to the least promising.
+
+        Moves are ordered by how much they change the score in one turn: this
+        player's score less penalties on its own turns, and on its opponents'
+        turns, either the opponent's score less penalties (expectimax) or the
+        negation of this player's score (minimax).
+
+        If <stop> is not None, the moves are tried in a random order, and once
+        time.monotonic() reaches <stop>, only PASS and the moves tried so far,
+        of which there is at least one, are ordered. Otherwise, raise
+        _SearchTimeout if the deadline of the search passes while the moves
+        are ordered. Raise _SearchTimeout if the search is cancelled.
+        """
+        goal = self._turn_goal(turn)
+        scorer = goal if turn == 0 or self._expectimax else self.goal
+        moves = list(legal_moves(board, goal.colour))
+        if stop is not None:
+            self._rng.shuffle(moves)
+        moves.insert(0, _create_move(PASS, board))
+        gains = {}
+        for move in moves:
+            if _cancelled(self._cancel):
+                raise _SearchTimeout
+            if stop is not None:
+                if len(gains) > 1 and _past(stop):
+                    break
+            elif _past(self._deadline):
+                raise _SearchTimeout
+            gain = scorer.score_delta(board, move[2], move[0], move[1],
+                                      goal.colour, self._rng)
+            if scorer is goal:
+                gain -= ACTION_PENALTY[(move[0], move[1])]
+            else:
+                gain = -gain
+            gains[id(move)] = gain
+        moves = [move for move in moves if id(move) in gains]
+        moves.sort(key=lambda m: gains[id(m)], reverse=True)
+        return moves[:self._width]
+
+    def _search_root(self, board: Block,
+                     moves: List[Tuple[str, Optional[int], Block]],
+                     depth: int) -> Tuple[str, Optional[int], Block]:
+        """Return the best of <moves> on <board> for this player, searching
+        <depth> turns ahead, including this one.
+        """
+        best = moves[0]
+        alpha = -math.inf
+        for move in moves:
+            value = self._search_move(board, move, 0, depth, alpha, math.inf)
+            if value > alpha:
+                best, alpha = move, value
+        return best
+
+    def _search_move(self, board: Block, move: Tuple[str, Optional[int], Block],
+                     turn: int, depth: int, alpha: float, beta: float) -> float:
+        """Return the value of making <move> on <board> on the turn of the
+        player <turn>, searching <depth> turns ahead including this one.
+
+        The value is this player's score at the end of the search, less the
+        penalties of this player's moves. <board> is left as it was.
+        """
+        undo = move[2].apply_move(move[0], move[1],
+                                  self._turn_goal(turn).colour, self._rng)
+        try:
+            value = self._search(board, (turn + 1) % (len(self._opponents) + 1),
+                                 depth - 1, alpha, beta)
+        finally:
+            undo_move(undo)
+        if turn == 0:
+            value -= ACTION_PENALTY[(move[0], move[1])]
+        return value
+
+    def _search(self, board: Block, turn: int, depth: int, alpha: float,
+                beta: float) -> float:
+        """Return the value of <board> when it is the turn of the player
+        <turn>, searching <depth> turns ahead, as for _search_move.
+
+        Values outside of the window from <alpha> to <beta> only need to be
+        bounds, so the moves that cannot change the result are pruned.
+
+        Raise _SearchTimeout if the deadline of the search has passed, or the
+        search has been cancelled.
+        """
+        self.nodes_searched += 1
+        if _past(self._deadline) or _cancelled(self._cancel):
+            raise _SearchTimeout
+        if depth == 0:
+            return self.goal.score(board)
+
+        key = (hash(board), depth, turn)
+        entry = self._table.get(key)
+        if entry is not None:
+            value, bound = entry
+            if bound == 0 or (bound > 0 and value >= beta) or \
+                    (bound < 0 and value <= alpha):
+                return value
+
+        chance = turn != 0 and self._expectimax
+        window = (-math.inf, math.inf) if chance else (alpha, beta)
+        values = []
+        for move in self._ordered_moves(board, turn):
+            value = self._search_move(board, move, turn, depth, *window)
+            values.append(value)
+            if turn == 0:
+                window = (max(window[0], value), window[1])
+            elif not chance:
+                window = (window[0], min(window[1], value))
+            if window[0] >= window[1]:
+                break
+
+        if turn == 0:
+            value = max(values)
+        elif chance:
+            value = sum(values) / len(values)
+        else:
+            value = min(values)
+        if chance or alpha < value < beta:
+            self._table.put(key, (value, 0))
+        else:
+            self._table.put(key, (value, 1 if value >= beta else -1))
+        return value
+
+
+# A move that names its Block by the indices of the children to follow to it
+# from the board: its action, its direction and that path.
+_PathMove = Tuple[str, Optional[int], List[int]]
+
+
+class _TreeNode:
+    """A node in the search tree of an MCTSPlayer, for the board reached by
+    making the moves on the path to it from the root.
+
+    === Public Attributes ===
+    key:
+        The hash of the board when this node was created.
+    turn:
+        Whose turn it is on the board of this node: 0 for the MCTSPlayer, and
+        i for the i-th of its opponents.
+    move:
+        The move that leads to this node from its parent, or None for the root.
+    parent:
+        The parent of this node, or None for the root.
+    children:
+        The nodes of the moves from this node that have been tried. On an
+        opponent's turn, there is one node for each board that its moves have
+        led to.
+    untried:
+        The moves from this node that have not been tried, in a random order,
+        or None if they have not been listed yet. This is only used on the
+        MCTSPlayer's own turns.
+    visits:
+        The number of searches through this node.
+    total:
+        The sum of the rewards of the searches through this node.
+    """
+    key: int
+    turn: int
+    move: Optional[_PathMove]
+    parent: Optional[_TreeNode]
+    children: List[_TreeNode]
+    untried: Optional[List[_PathMove]]
+    visits: int
+    total: float
+
+    def __init__(self, key: int, turn: int, move: Optional[_PathMove],
+                 parent: Optional[_TreeNode]) -> None:
+        """Initialize this node with no searches through it.
+        """
+        self.key = key
+        self.turn = turn
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = None
+        self.visits = 0
+        self.total = 0.0
+
+
+class MCTSPlayer(ComputerPlayer):
+    """A player in the game of blocky that chooses its moves by Monte Carlo
+    tree search.
+
+    The tree has a level for each turn, this player's and each of its
+    opponents', in the order that they play. Each search descends the tree,
+    choosing this player's moves by UCT and its opponents' moves at random, as
+    a RandomPlayer with the opponent's goal would, until it tries one new move
+    or reaches one new board. It then plays random moves for each player in
+    turn, up to a fixed horizon. The reward of the search is the score of this
+    player's goal at the horizon, less the penalties of its own moves in the
+    tree. The most searched move is made.
+
+    The tree is kept between turns, and reused from the node for the board on
+    this player's next turn, if the opponents' moves since have led to a board
+    that the tree has already reached.
+
+    === Public Attributes ===
+    iterations:
+        The number of searches the last time this player generated a move.
+    """
+    # === Private Attributes ===
+    # _horizon:
+    #   The number of random moves played after the tree in each search, by
+    #   all of the players.
+    # _opponents:
+    #   The goals of the other players, in the order that they play after this
+    #   player.
+    # _node_budget:
+    #   The most searches each turn.
+    # _time_budget:
+    #   The most time, in milliseconds, that searching may take each turn, or
+    #   None if there is no limit.
+    # _exploration:
+    #   The exploration constant of UCT.
+    # _rng:
+    #   The source of randomness for the searches.
+    # _root:
+    #   The node of the last board this player moved to, or None.
+    # _scale:
+    #   The largest reward seen, which scales exploration to the goal's
+    #   scores.
+    iterations: int
+    _horizon: int
+    _opponents: List[Goal]
+    _node_budget: int
+    _time_budget: Optional[float]
+    _exploration: float
+    _rng: random.Random
+    _root: Optional[_TreeNode]
+    _scale: float
+
+    def __init__(self, player_id: int, goal: Goal, horizon: int = 10,
+                 node_budget: int = 1000, time_budget: Optional[float] = None,
+                 exploration: float = math.sqrt(2),
+                 seed: Optional[int] = None,
+                 opponents: Optional[List[Goal]] = None) -> None:
+        """Initialize this MCTSPlayer.
+
+        Each turn it searches <node_budget> times, or for <time_budget>
+        milliseconds if that runs out first, playing <horizon> random moves
+        at the end of each search. <opponents> are the goals of the other
+        players, in the order that they play after this player.
+
+        Precondition:
+            - horizon >= 0
+            - node_budget >= 1
+        """
+        ComputerPlayer.__init__(self, player_id, goal)
+        self._horizon = horizon
+        self._opponents = [] if opponents is None else opponents
+        self._node_budget = node_budget
+        self._time_budget = time_budget
+        self._exploration = exploration
+        self._rng = random.Random(seed)
+        self._root = None
+        self._scale = 1.0
+        self.iterations = 0
+
+    def generate_move(self, board: Block,
+                      cancel: Optional[threading.Event] = None) ->\
+            Optional[Tuple[str, Optional[int], Block]]:
+        """Return the move from <board> that was searched the most, or PASS
+        if no move was searched.
+
+        Searching stops early if the time budget runs out or <cancel> is set.
+
         This function does not mutate <board>.
         """
-        # Reviewed 17/03/2020, though the code is still quite long. Nested (4/3)
-        n = self._difficulty
-        max_action = PASS
-        max_board_child = board
-        max_ = self.goal.score(board)  # These variables store the best move
         if not self._proceed:
             return None  # Do not remove
-        while n > 0:  # Come up with n possible moves
-            success = False
-            while not success:
-                copy = board.create_copy()
-                # Iterate both board and copy to the desired child level
-                board_and_copy = _helper_generate_move_level(board, copy)
-                board_child = board_and_copy[0]
-                copy_child = board_and_copy[1]
-                # Choose an action at random and store its penalty
-                action_and_penalty = _helper_generate_move_choose()
-                action = action_and_penalty[0]
-                penalty = action_and_penalty[1]
-                # Check if the move is valid
-                success = self._helper_generate_move_check(action, copy_child)
-                if success:  # Compare and store if this is the best move so far
-                    current = self.goal.score(copy) - penalty
-                    # Round-about fix due to nested warning (4/3)
-                    max_action = action if current > max_ else max_action
-                    max_board_child = board_child if current > max_ \
-                        else max_board_child
-                    max_ = current if current > max_ else max_
-                    n -= 1
+        root = self._reuse_root(board)
+        deadline = None if self._time_budget is None else \
+            time.monotonic() + self._time_budget / 1000
+        self.iterations = 0
+        while self.iterations < self._node_budget and \
+                not _past(deadline) and not _cancelled(cancel):
+            self._search(board, root)
+            self.iterations += 1
         self._proceed = False
-        return _create_move(max_action, max_board_child)
+
+        if len(root.children) == 0:
+            self._root = None
+            return _create_move(PASS, board)
+        best = max(root.children, key=lambda child: child.visits)
+        self._root = best
+        return _create_move(best.move[:2], board.follow_path(best.move[2]))
+
+    def _reuse_root(self, board: Block) -> _TreeNode:
+        """Return the node of the tree kept from the last turn that is for
+        <board> on this player's turn, as the root of a new tree, or a new root
+        if there is none.
+        """
+        key = hash(board)
+        nodes = [] if self._root is None else [self._root]
+        for node in nodes:
+            if node.key == key and node.turn == 0:
+                node.parent = None
+                node.move = None
+                return node
+            # The boards of this player's later turns are not searched, since
+            # its moves since would have to be in the tree too
+            if node.turn != 0 or node is self._root:
+                nodes.extend(node.children)
+        return _TreeNode(key, 0, None, None)
+
+    def _colour(self, turn: int) -> Tuple[int, int, int]:
+        """Return the colour that the player whose turn is <turn> paints with,
+        where <turn> is 0 for this player and i for the i-th of its opponents.
+        """
+        return self.goal.colour if turn == 0 else \
+            self._opponents[turn - 1].colour
+
+    def _next_turn(self, turn: int) -> int:
+        """Return the turn after <turn>, numbered as for _colour.
+        """
+        return (turn + 1) % (len(self._opponents) + 1)
+
+    def _search(self, board: Block, root: _TreeNode) -> None:
+        """Search the tree from <root>, which is for <board>, once, and add
+        the reward of the search to every node it went through.
+
+        <board> is left as it was.
+        """
+        node = root
+        undos = []
+        penalty = 0
+        try:
+            # Descend until a new node is added, or a move cannot be made
+            while True:
+                if node.turn != 0:
+                    child = self._opponent_move(board, node, undos)
+                    if child.visits == 0:
+                        node = child
+                        break
+                elif node.untried is None or len(node.untried) > 0:
+                    child = self._expand(board, node, undos)
+                    if child is not None:
+                        penalty += ACTION_PENALTY[child.move[:2]]
+                        node = child
+                    break
+                else:
+                    child = max(node.children,
+                                key=lambda c: self._uct(node, c))
+                    undo = self._play(board, child.move)
+                    if undo is None:
+                        break  # A smash higher up made this move impossible
+                    undos.append(undo)
+                    penalty += ACTION_PENALTY[child.move[:2]]
+                node = child
+
+            # Play random moves for each player in turn up to the horizon
+            turn = node.turn
+            for _ in range(self._horizon):
+                colour = self._colour(turn)
+                move = _random_move(board, colour, self._rng)
+                undos.append(move[2].apply_move(move[0], move[1], colour,
+                                                self._rng))
+                turn = self._next_turn(turn)
+            reward = self.goal.score(board) - penalty
+        finally:
+            for undo in reversed(undos):
+                undo_move(undo)
+
+        self._scale = max(self._scale, abs(reward))
+        while node is not None:
+            node.visits += 1
+            node.total += reward
+            node = node.parent
+
+    def _expand(self, board: Block, node: _TreeNode,
+                undos: List[Undo]) -> Optional[_TreeNode]:
+        """Make an untried move from <node>, which is for <board> on this
+        player's turn, and return the new child of <node> for it, adding the
+        move's undo token to <undos>. Return None if the move cannot be made
+        on <board>.
+
+        PASS is always among the moves, so there is always one to try.
+        """
+        if node.untried is None:
+            node.untried = [(move[0], move[1], board.path_to(move[2]))
+                            for move in legal_moves(board, self.goal.colour)]
+            node.untried.append((PASS[0], PASS[1], []))
+            self._rng.shuffle(node.untried)
+        move = node.untried.pop()
+        undo = self._play(board, move)
+        if undo is None:
+            return None  # A smash higher up made this move impossible
+        undos.append(undo)
+        child = _TreeNode(hash(board), self._next_turn(0), move, node)
+        node.children.append(child)
+        return child
+
+    def _opponent_move(self, board: Block, node: _TreeNode,
+                       undos: List[Undo]) -> _TreeNode:
+        """Make a random move for the opponent whose turn it is on <node>,
+        which is for <board>, and return the child of <node> for the board it
+        leads to, adding one if there is none, and adding the move's undo
+        token to <undos>.
+        """
+        colour = self._colour(node.turn)
+        move = _random_move(board, colour, self._rng)
+        path_move = (move[0], move[1], board.path_to(move[2]))
+        undos.append(move[2].apply_move(move[0], move[1], colour, self._rng))
+        key = hash(board)
+        for child in node.children:
+            if child.key == key:
+                return child
+        child = _TreeNode(key, self._next_turn(node.turn), path_move, node)
+        node.children.append(child)
+        return child
+
+    def _uct(self, node: _TreeNode, child: _TreeNode) -> float:
+        """Return the UCT value of <child>, a child of <node>.
+        """
+        return child.total / child.visits + self._exploration * self._scale * \
+            math.sqrt(math.log(node.visits) / child.visits)
+
+    def _play(self, board: Block, move: _PathMove) -> Optional[Undo]:
+        """Make <move> on <board> and return its undo token, or None if the
+        move cannot be made on <board>.
+        """
+        block = board.follow_path(move[2])
+        if block is None:
+            return None
+        return block.apply_move(move[0], move[1], self.goal.colour, self._rng)
 
 
 if __name__ == '__main__':
@@ -396,8 +1210,10 @@ if __name__ == '__main__':
         'allowed-io': ['process_event'],
         'allowed-import-modules': [
             'doctest', 'python_ta', 'random', 'typing', 'actions', 'block',
-            'goal', 'pygame', '__future__'
+            'goal', 'parallel', 'pygame', '__future__', 'time', 'math',
+            'threading', 'itertools'
         ],
-        'max-attributes': 10,
+        'max-attributes': 12,
+        'max-args': 9,
         'generated-members': 'pygame.*'
     })
@@ -36,6 +36,11 @@ TEMPTING_TURQUOISE = (75, 196, 213)
 # A pallette of the colours we use in the game
 COLOUR_LIST = [PACIFIC_POINT, REAL_RED, OLD_OLIVE, DAFFODIL_DELIGHT]
 
+# The index of each colour in COLOUR_LIST, for compact board encodings.
+COLOUR_INDEX = {colour: i for i, colour in enumerate(COLOUR_LIST)}
+# The index used in compact board encodings for a colour not in COLOUR_LIST.
+NO_COLOUR_INDEX = 255
+
 # The game board will be a square with this size.
 BOARD_SIZE = 750
 